@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+from sqlalchemy import event
+
+from ..models.user import User
+
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", "60"))  # seconds
+
+
+class UserSnapshot:
+    # Detached, read-only view of the authenticated user; safe to share
+    # between requests unlike an ORM instance bound to a session
+    __slots__ = ("id", "username", "email", "is_active")
+
+    def __init__(self, id: int, username: str, email: str, is_active: bool):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.is_active = is_active
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserSnapshot":
+        return cls(user.id, user.username, user.email, user.is_active)
+
+
+class PrincipalCache:
+    def __init__(self, max_size: int = PRINCIPAL_CACHE_SIZE, ttl: int = PRINCIPAL_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._tokens_by_user: Dict[int, Set[str]] = {}
+        # Sync endpoints resolve dependencies on threadpool workers
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[tuple]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            deadline, claims, user = entry
+            if deadline <= time.monotonic():
+                self._remove(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return claims, user
+
+    def put(self, token: str, claims: dict, user: UserSnapshot):
+        if self.max_size <= 0:
+            return
+        ttl = self.ttl
+        exp = claims.get("exp")
+        if exp is not None:
+            # Never serve a token past its own expiry
+            ttl = min(ttl, exp - time.time())
+        if ttl <= 0:
+            return
+        with self._lock:
+            if token in self._entries:
+                self._remove(token)
+            self._entries[token] = (time.monotonic() + ttl, claims, user)
+            self._tokens_by_user.setdefault(user.id, set()).add(token)
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for token in self._tokens_by_user.pop(user_id, set()):
+                self._entries.pop(token, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, token: str):
+        _, _, user = self._entries.pop(token)
+        tokens = self._tokens_by_user.get(user.id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[user.id]
+
+
+principal_cache = PrincipalCache()
+
+
+# Drop cached principals whenever a user row is changed or removed
+# through the ORM (profile edits, deactivation, deletion)
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target):
+    principal_cache.invalidate_user(target.id)
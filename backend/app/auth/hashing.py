@@ -0,0 +1,66 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+from ..monitoring.metrics import PASSWORD_HASH_PENDING, PASSWORD_HASH_REJECTED, PASSWORD_HASH_SECONDS
+
+# bcrypt releases the GIL while hashing, so a small dedicated thread pool
+# gives real parallelism without competing with the request threadpool
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+class HasherOverloaded(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rejected = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", pwd_context.hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run("verify", pwd_context.verify, plain_password, hashed_password)
+
+    async def _run(self, operation: str, fn, *args):
+        # Reject immediately instead of queueing work we cannot finish in time
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                PASSWORD_HASH_REJECTED.inc()
+                raise HasherOverloaded()
+            self._pending += 1
+        try:
+            return await asyncio.wrap_future(self._executor.submit(self._timed, operation, fn, *args))
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    @staticmethod
+    def _timed(operation: str, fn, *args):
+        # Measured on the worker, so queueing time isn't counted as bcrypt time
+        with PASSWORD_HASH_SECONDS.labels(operation).time():
+            return fn(*args)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+password_hasher = PasswordHasher()
+PASSWORD_HASH_PENDING.set_function(lambda: password_hasher.pending)
@@ -1,11 +1,16 @@
 from datetime import datetime, timedelta
+from typing import Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
+from starlette.concurrency import run_in_threadpool
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from ..database import get_db
+from ..database import get_async_db
 from ..models.user import User
+from .cache import principal_cache, UserSnapshot
+from .hashing import pwd_context, password_hasher
 import os
 from dotenv import load_dotenv
 
@@ -15,7 +20,6 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/token")
 
 def verify_password(plain_password, hashed_password):
@@ -24,11 +28,15 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = db.query(User).filter(User.username == username).first()
+def get_user_by_username(db: Session, username: str):
+    return db.query(User).filter(User.username == username).first()
+
+async def authenticate_user(db: Session, username: str, password: str):
+    # Lookup runs on the request threadpool, bcrypt on the bounded hasher pool
+    user = await run_in_threadpool(get_user_by_username, db, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await password_hasher.verify(password, user.hashed_password):
         return False
     return user
 
@@ -42,20 +50,34 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+async def authenticate_token(token: str, db: AsyncSession) -> Optional[UserSnapshot]:
+    """The active user ``token`` was issued to, or None if it is not valid."""
+    cached = principal_cache.get(token)
+    if cached is not None:
+        return cached[1]
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
-    user = db.query(User).filter(User.username == username).first()
+        return None
+    username: str = payload.get("sub")
+    if username is None:
+        return None
+    # Cache miss: the async session keeps this lookup off the event loop
+    user = (await db.execute(select(User).where(User.username == username))).scalar_one_or_none()
+    if user is None or not user.is_active:
+        # Deactivation evicts cached principals, so this also applies at once
+        # to tokens already in use
+        return None
+    snapshot = UserSnapshot.from_user(user)
+    principal_cache.put(token, payload, snapshot)
+    return snapshot
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    user = await authenticate_token(token, db)
     if user is None:
-        raise credentials_exception
-    return user
\ No newline at end of file
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
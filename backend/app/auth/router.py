@@ -6,7 +6,9 @@ from typing import List
 
 from ..database import get_db
 from ..models.user import User
-from .jwt import authenticate_user, create_access_token, get_password_hash, ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user
+from .jwt import authenticate_user, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user
+from .hashing import password_hasher, HasherOverloaded
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 
 router = APIRouter(tags=["Authentication"])
@@ -28,8 +30,14 @@ class UserOut(BaseModel):
     class Config:
         orm_mode = True
 
-@router.post("/register", response_model=UserOut)
-def register_user(user: UserCreate, db: Session = Depends(get_db)):
+def _hasher_overloaded():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many concurrent authentication requests, retry shortly",
+        headers={"Retry-After": "1"},
+    )
+
+def _check_registration(db: Session, user: UserCreate):
     db_user = db.query(User).filter(User.username == user.username).first()
     if db_user:
         raise HTTPException(
@@ -43,17 +51,29 @@ def register_user(user: UserCreate, db: Session = Depends(get_db)):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
-    
-    hashed_password = get_password_hash(user.password)
+
+def _create_user(db: Session, user: UserCreate, hashed_password: str):
     db_user = User(username=user.username, email=user.email, hashed_password=hashed_password)
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
     return db_user
 
+@router.post("/register", response_model=UserOut)
+async def register_user(user: UserCreate, db: Session = Depends(get_db)):
+    await run_in_threadpool(_check_registration, db, user)
+    try:
+        hashed_password = await password_hasher.hash(user.password)
+    except HasherOverloaded:
+        raise _hasher_overloaded()
+    return await run_in_threadpool(_create_user, db, user, hashed_password)
+
 @router.post("/token", response_model=Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    try:
+        user = await authenticate_user(db, form_data.username, form_data.password)
+    except HasherOverloaded:
+        raise _hasher_overloaded()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
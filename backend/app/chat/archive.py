@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import os
+from datetime import timedelta
+from typing import Callable, Iterable, List, Optional
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from ..database import SessionLocal
+from ..models.message import ArchivedMessage, Message
+from ..monitoring.metrics import MESSAGES_ARCHIVED
+from .serialization import epoch_ms, message_payloads, now
+
+# Messages older than this leave the hot table; 0 keeps everything hot
+MESSAGE_ARCHIVE_AFTER_DAYS = int(os.getenv("MESSAGE_ARCHIVE_AFTER_DAYS", "90"))
+# Each batch is one short transaction; the pause between batches leaves
+# the database to live traffic while a large backlog is worked off
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+ARCHIVE_BATCH_PAUSE_MS = int(os.getenv("ARCHIVE_BATCH_PAUSE_MS", "200"))
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+
+logger = logging.getLogger(__name__)
+
+_COLUMNS = [column.name for column in ArchivedMessage.__table__.columns]
+# pg_try_advisory_xact_lock key held while a batch is moved
+_ARCHIVE_LOCK_KEY = 0x61726368
+
+# Builds the WHERE clauses of one conversation for either table
+Criteria = Callable[[type], Iterable]
+
+
+class MessageArchiver:
+    """Background compaction that moves old messages to ``messages_archive``.
+
+    Messages leave in id order, so the archive always holds exactly the ids
+    up to its largest one and the hot table everything after. Readers look
+    that boundary up to decide whether a page can touch the archive at all.
+    Every worker runs an archiver; on PostgreSQL an advisory lock lets one
+    of them move each batch, elsewhere the database serialises the writes
+    and a batch that loses the race is rolled back.
+    """
+
+    def __init__(self, session_factory=SessionLocal,
+                 retention_days: int = MESSAGE_ARCHIVE_AFTER_DAYS,
+                 batch_size: int = ARCHIVE_BATCH_SIZE,
+                 pause_ms: int = ARCHIVE_BATCH_PAUSE_MS,
+                 interval: int = ARCHIVE_INTERVAL_SECONDS):
+        self.session_factory = session_factory
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.pause = pause_ms / 1000
+        self.interval = interval
+        self.archived_through = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self.running:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                # Other workers may have moved the boundary since our last pass
+                self.archived_through = await run_in_threadpool(self._load_boundary)
+                if self.retention_days:
+                    await self.compact()
+            except Exception:
+                logger.exception("message archival failed")
+            await asyncio.sleep(self.interval)
+
+    async def compact(self) -> int:
+        """Archive everything past the retention window, one batch at a time."""
+        cutoff = epoch_ms(now() - timedelta(days=self.retention_days))
+        total = 0
+        while True:
+            moved, boundary = await run_in_threadpool(self._move_batch, cutoff)
+            if not moved:
+                break
+            self.archived_through = boundary
+            total += moved
+            MESSAGES_ARCHIVED.inc(moved)
+            await asyncio.sleep(self.pause)
+        if total:
+            logger.info("archived messages", extra={"count": total, "archived_through": self.archived_through})
+        return total
+
+    def _load_boundary(self) -> int:
+        db = self.session_factory()
+        try:
+            return db.execute(select(func.max(ArchivedMessage.id))).scalar() or 0
+        finally:
+            db.close()
+
+    def _move_batch(self, cutoff):
+        db = self.session_factory()
+        try:
+            if db.get_bind().dialect.name == "postgresql" and not db.execute(
+                select(func.pg_try_advisory_xact_lock(_ARCHIVE_LOCK_KEY))
+            ).scalar():
+                # Another worker is archiving; its batches will cover ours
+                return 0, self.archived_through
+            # The oldest rows by id; the batch ends at the first one still
+            # inside the window, which keeps the archive a prefix of ids
+            oldest = db.execute(
+                select(Message.id, Message.created_at).order_by(Message.id.asc()).limit(self.batch_size)
+            ).all()
+            # The newest row always stays: SQLite ids are not AUTOINCREMENT,
+            # so an empty messages table would hand out archived ids again
+            newest = db.execute(select(func.max(Message.id))).scalar()
+            boundary = None
+            for message_id, created_at in oldest:
+                if message_id >= newest or created_at is None or epoch_ms(created_at) >= cutoff:
+                    break
+                boundary = message_id
+            if boundary is None:
+                return 0, self.archived_through
+
+            source = select(*[Message.__table__.c[name] for name in _COLUMNS]).where(Message.id <= boundary)
+            db.execute(insert(ArchivedMessage).from_select(_COLUMNS, source))
+            moved = db.execute(delete(Message).where(Message.id <= boundary)).rowcount
+            db.commit()
+            # A Core delete skips the ORM hook that evicts cached payloads
+            for message_id, _ in oldest:
+                if message_id > boundary:
+                    break
+                message_payloads.invalidate(message_id)
+            return moved, boundary
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+async def _page(db: AsyncSession, model, criteria: Criteria,
+                before_id: Optional[int], after_id: Optional[int], limit: int, ascending: bool):
+    # Keyset pagination on the primary key: each page is an index range scan
+    query = select(model).where(*criteria(model))
+    if before_id is not None:
+        query = query.where(model.id < before_id)
+    if after_id is not None:
+        query = query.where(model.id > after_id)
+    if ascending:
+        return list((await db.execute(query.order_by(model.id.asc()).limit(limit))).scalars())
+    return list((await db.execute(query.order_by(model.id.desc()).limit(limit))).scalars())[::-1]
+
+
+async def archived_boundary(db: AsyncSession) -> int:
+    # Read per request, not cached: any worker may have moved it. The max
+    # of the primary key is a single index probe.
+    return (await db.execute(select(func.max(ArchivedMessage.id)))).scalar() or 0
+
+
+async def paginate(db: AsyncSession, criteria: Criteria, before_id: Optional[int],
+                   after_id: Optional[int], limit: int) -> List:
+    """One page of a conversation, in ascending id order, from either table.
+
+    Pages inside the hot window never query the archive: newest-first pages
+    fall back to it only when the hot table runs out, and after_id pages
+    only when the cursor is below the archive boundary. The boundary is read
+    after the hot table, so rows archived in between are found in the archive.
+    """
+    ascending = after_id is not None and before_id is None
+    messages = await _page(db, Message, criteria, before_id, after_id, limit, ascending)
+    if ascending:
+        if after_id < await archived_boundary(db):
+            # Below whatever the hot table returned, so nothing is listed twice
+            below = messages[0].id if messages else None
+            older = await _page(db, ArchivedMessage, criteria, below, after_id, limit, True)
+            messages = (older + messages)[:limit]
+        return messages
+
+    if len(messages) < limit:
+        boundary = await archived_boundary(db)
+        if boundary and (after_id is None or after_id < boundary):
+            below = messages[0].id if messages else before_id
+            older = await _page(db, ArchivedMessage, criteria, below, after_id, limit - len(messages), False)
+            messages = older + messages
+    return messages
+
+
+archiver = MessageArchiver()
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Optional
+from urllib.parse import unquote, urlparse
+
+from .serialization import decode, encode_text
+
+logger = logging.getLogger(__name__)
+
+# memory://                      single process, events are dispatched in place
+# redis://[:password@]host:port  any server speaking the Redis protocol
+# unix:///path/to/redis.sock     same protocol over a local socket
+CHAT_BROKER_URL = os.getenv("CHAT_BROKER_URL", "memory://")
+CHAT_BROKER_CHANNEL = os.getenv("CHAT_BROKER_CHANNEL", "chat-portal:events")
+
+EventHandler = Callable[[dict], Awaitable[None]]
+
+
+class BrokerError(Exception):
+    pass
+
+
+class Broker:
+    # Whether events published now will be delivered (readiness checks)
+    connected = True
+
+    async def start(self, handler: EventHandler):
+        raise NotImplementedError
+
+    async def publish(self, event: dict):
+        raise NotImplementedError
+
+    async def stop(self):
+        pass
+
+
+class MemoryBroker(Broker):
+    def __init__(self):
+        self._handler: Optional[EventHandler] = None
+
+    async def start(self, handler: EventHandler):
+        self._handler = handler
+
+    async def publish(self, event: dict):
+        if self._handler is not None:
+            await self._handler(event)
+
+
+def _encode_command(*args) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+async def _read_reply(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Broker connection closed")
+    kind, body = line[:1], line[1:-2]
+    if kind == b"+":
+        return body.decode()
+    if kind == b"-":
+        raise BrokerError(body.decode())
+    if kind == b":":
+        return int(body)
+    if kind == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    if kind == b"*":
+        length = int(body)
+        if length < 0:
+            return None
+        return [await _read_reply(reader) for _ in range(length)]
+    raise BrokerError(f"Unexpected reply from broker: {line!r}")
+
+
+class RedisBroker(Broker):
+    # Minimal RESP client: one connection publishes, one stays subscribed
+    def __init__(self, url: str, channel: str = CHAT_BROKER_CHANNEL,
+                 reconnect_delay: float = 1.0, connect_timeout: float = 10.0):
+        parsed = urlparse(url)
+        self.url = url
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self.connect_timeout = connect_timeout
+        self._unix_path = unquote(parsed.path) if parsed.scheme == "unix" else None
+        self._host = parsed.hostname or "localhost"
+        self._port = parsed.port or 6379
+        self._password = unquote(parsed.password) if parsed.password else None
+        self._handler: Optional[EventHandler] = None
+        self._publisher = None
+        self._publish_lock = asyncio.Lock()
+        self._subscriber_task: Optional[asyncio.Task] = None
+        self._subscribed = asyncio.Event()
+
+    @property
+    def connected(self) -> bool:
+        return self._subscribed.is_set()
+
+    async def _open(self):
+        if self._unix_path is not None:
+            reader, writer = await asyncio.open_unix_connection(self._unix_path)
+        else:
+            reader, writer = await asyncio.open_connection(self._host, self._port)
+        if self._password is not None:
+            writer.write(_encode_command("AUTH", self._password))
+            await writer.drain()
+            await _read_reply(reader)
+        return reader, writer
+
+    async def start(self, handler: EventHandler):
+        self._handler = handler
+        self._subscriber_task = asyncio.create_task(self._subscribe_forever())
+        # Don't report ready until events published from here can come back
+        try:
+            await asyncio.wait_for(self._subscribed.wait(), self.connect_timeout)
+        except asyncio.TimeoutError:
+            await self.stop()
+            raise BrokerError(f"Could not subscribe to broker at {self.url}")
+
+    async def publish(self, event: dict):
+        data = encode_text(event)
+        async with self._publish_lock:
+            for attempt in range(2):
+                try:
+                    if self._publisher is None:
+                        self._publisher = await self._open()
+                    reader, writer = self._publisher
+                    writer.write(_encode_command("PUBLISH", self.channel, data))
+                    await writer.drain()
+                    await _read_reply(reader)
+                    return
+                except (ConnectionError, OSError, asyncio.IncompleteReadError):
+                    self._close_publisher()
+                    if attempt:
+                        raise
+
+    async def _subscribe_forever(self):
+        while True:
+            writer = None
+            try:
+                reader, writer = await self._open()
+                writer.write(_encode_command("SUBSCRIBE", self.channel))
+                await writer.drain()
+                await _read_reply(reader)  # subscribe confirmation
+                self._subscribed.set()
+                while True:
+                    reply = await _read_reply(reader)
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                        try:
+                            await self._handler(decode(reply[2]))
+                        except Exception:
+                            logger.exception("broker event handler failed")
+            except asyncio.CancelledError:
+                raise
+            except (ConnectionError, OSError, asyncio.IncompleteReadError, BrokerError) as exc:
+                self._subscribed.clear()
+                logger.warning("broker subscription lost, reconnecting", extra={"error": repr(exc)})
+            finally:
+                if writer is not None:
+                    writer.close()
+            await asyncio.sleep(self.reconnect_delay)
+
+    def _close_publisher(self):
+        if self._publisher is not None:
+            self._publisher[1].close()
+            self._publisher = None
+
+    async def stop(self):
+        if self._subscriber_task is not None:
+            self._subscriber_task.cancel()
+            try:
+                await self._subscriber_task
+            except asyncio.CancelledError:
+                pass
+            self._subscriber_task = None
+        self._close_publisher()
+
+
+def create_broker(url: str = CHAT_BROKER_URL) -> Broker:
+    scheme = urlparse(url).scheme
+    if scheme == "memory":
+        return MemoryBroker()
+    if scheme in ("redis", "unix"):
+        return RedisBroker(url)
+    raise ValueError(f"Unsupported CHAT_BROKER_URL scheme: {scheme!r}")
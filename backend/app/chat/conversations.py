@@ -0,0 +1,161 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import case, func, insert, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from ..database import SessionLocal
+from ..models.conversation import Conversation
+from ..models.message import Message
+from .membership import group_index
+
+PREVIEW_LENGTH = 120
+
+_UPSERTS = {"sqlite": sqlite_insert, "postgresql": postgresql_insert}
+_LAST_MESSAGE_COLUMNS = ("last_message_id", "last_message_preview", "last_sender_id", "last_message_at")
+
+
+def conversation_key(peer_id: Optional[int] = None, group_id: Optional[int] = None) -> str:
+    if group_id:
+        return f"group:{group_id}"
+    return f"user:{peer_id}"
+
+
+def _participants(message: Message) -> Iterable[Tuple[int, Optional[int], Optional[int]]]:
+    # (user_id, peer_id, group_id) for every inbox the message lands in
+    if message.group_id:
+        for member_id in group_index.members(message.group_id) | {message.sender_id}:
+            yield member_id, None, message.group_id
+        return
+    yield message.sender_id, message.receiver_id, None
+    if message.receiver_id is not None and message.receiver_id != message.sender_id:
+        yield message.receiver_id, message.sender_id, None
+
+
+def update_conversations(db: Session, messages: Iterable[Message]):
+    """Fold newly flushed messages into the conversation summaries.
+
+    Runs inside the caller's transaction, after ids have been assigned, so
+    the summaries commit atomically with the messages.
+    """
+    changes: Dict[Tuple[int, str], dict] = {}
+    for message in sorted(messages, key=lambda message: message.id):
+        for user_id, peer_id, group_id in _participants(message):
+            change = changes.setdefault((user_id, conversation_key(peer_id, group_id)), {
+                "peer_id": peer_id, "group_id": group_id, "unread": 0, "read_up_to": None
+            })
+            change["message"] = message
+            if user_id == message.sender_id:
+                # Replying means everything before it has been seen
+                change["unread"] = 0
+                change["read_up_to"] = message.id
+            else:
+                change["unread"] += 1
+    if not changes:
+        return
+
+    replies, received = [], []
+    for (user_id, key), change in changes.items():
+        message = change["message"]
+        row = {
+            "user_id": user_id, "conversation_key": key,
+            "peer_id": change["peer_id"], "group_id": change["group_id"],
+            "last_message_id": message.id,
+            "last_message_preview": (message.content or "")[:PREVIEW_LENGTH],
+            "last_sender_id": message.sender_id,
+            "last_message_at": message.created_at,
+            "last_read_message_id": change["read_up_to"] or 0,
+            "unread_count": change["unread"],
+        }
+        (replies if change["read_up_to"] is not None else received).append(row)
+
+    upsert = _UPSERTS.get(db.get_bind().dialect.name)
+    if upsert is None:
+        for rows, reply in ((replies, True), (received, False)):
+            for row in rows:
+                _update_or_insert(db, row, reply)
+        return
+    # Counters are incremented in SQL, so concurrent writers (other
+    # workers) neither collide on the unique key nor lose increments
+    for rows, reply in ((replies, True), (received, False)):
+        if not rows:
+            continue
+        statement = upsert(Conversation).values(rows)
+        excluded = statement.excluded
+        newer = or_(Conversation.last_message_id.is_(None),
+                    Conversation.last_message_id < excluded.last_message_id)
+        set_ = {name: case((newer, excluded[name]), else_=Conversation.__table__.c[name])
+                for name in _LAST_MESSAGE_COLUMNS}
+        if reply:
+            set_["last_read_message_id"] = excluded.last_read_message_id
+            set_["unread_count"] = excluded.unread_count
+        else:
+            set_["unread_count"] = Conversation.unread_count + excluded.unread_count
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[Conversation.user_id, Conversation.conversation_key], set_=set_
+        ))
+
+
+def _update_or_insert(db: Session, row: dict, reply: bool):
+    values = {name: row[name] for name in _LAST_MESSAGE_COLUMNS}
+    if reply:
+        values.update(last_read_message_id=row["last_read_message_id"], unread_count=row["unread_count"])
+    else:
+        values["unread_count"] = Conversation.unread_count + row["unread_count"]
+    updated = db.execute(update(Conversation).where(
+        Conversation.user_id == row["user_id"], Conversation.conversation_key == row["conversation_key"]
+    ).values(**values).execution_options(synchronize_session=False))
+    if not updated.rowcount:
+        db.execute(insert(Conversation).values(**row))
+
+
+async def count_unread(db: AsyncSession, conversation: Conversation) -> int:
+    # Both branches are range scans on the composite message indexes
+    query = select(func.count(Message.id)).where(Message.id > conversation.last_read_message_id)
+    if conversation.group_id:
+        query = query.where(Message.group_id == conversation.group_id,
+                            Message.sender_id != conversation.user_id)
+    else:
+        query = query.where(Message.sender_id == conversation.peer_id,
+                            Message.receiver_id == conversation.user_id)
+    return (await db.execute(query)).scalar()
+
+
+async def mark_read(db: AsyncSession, conversation: Conversation, message_id: Optional[int] = None):
+    if message_id is None or message_id >= (conversation.last_message_id or 0):
+        message_id = conversation.last_message_id or 0
+        conversation.unread_count = 0
+    if message_id <= conversation.last_read_message_id:
+        return conversation
+    conversation.last_read_message_id = message_id
+    if conversation.unread_count:
+        conversation.unread_count = await count_unread(db, conversation)
+    return conversation
+
+
+def rebuild_conversations(batch_size: int = 1000):
+    """Backfill summaries from existing messages; history counts as read."""
+    db = SessionLocal()
+    try:
+        db.query(Conversation).delete()
+        last_id = 0
+        while True:
+            batch = db.query(Message).filter(Message.id > last_id).order_by(Message.id).limit(batch_size).all()
+            if not batch:
+                break
+            update_conversations(db, batch)
+            db.flush()
+            last_id = batch[-1].id
+        db.query(Conversation).update({
+            Conversation.last_read_message_id: Conversation.last_message_id,
+            Conversation.unread_count: 0,
+        })
+        db.commit()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    rebuild_conversations()
@@ -0,0 +1,334 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from typing import Callable, Dict, Iterable, Optional, Set
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from ..monitoring.metrics import WS_CONNECTIONS, WS_FANOUT_SECONDS, WS_FRAMES_DROPPED, WS_SEND_QUEUE_DEPTH
+from .broker import Broker, create_broker
+from .serialization import encode_text
+from .transport import LEGACY, Frame, Transport, negotiate
+
+# Slow consumer policies:
+#   drop       - discard new frames once a connection's queue is full
+#   disconnect - close the connection once its queue is full
+#   coalesce   - unsent presence diffs are merged (latest state per user wins)
+#                and never count against the queue; chat frames are dropped
+#                when full
+SLOW_CONSUMER_POLICIES = ("drop", "disconnect", "coalesce")
+
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "coalesce")
+
+# Every node announces itself this often; a node silent for NODE_EXPIRY_SECONDS
+# is presumed dead (crashed, killed) and its users are marked offline
+NODE_HEARTBEAT_SECONDS = float(os.getenv("NODE_HEARTBEAT_SECONDS", "10"))
+NODE_EXPIRY_SECONDS = float(os.getenv("NODE_EXPIRY_SECONDS", "30"))
+
+logger = logging.getLogger(__name__)
+
+if WS_SLOW_CONSUMER_POLICY not in SLOW_CONSUMER_POLICIES:
+    raise ValueError(f"WS_SLOW_CONSUMER_POLICY must be one of {SLOW_CONSUMER_POLICIES}")
+
+
+def encode_presence_diff(changes: Dict[int, bool]) -> str:
+    return encode_text({
+        "type": "presence_diff",
+        "online": [user_id for user_id, is_online in changes.items() if is_online],
+        "offline": [user_id for user_id, is_online in changes.items() if not is_online]
+    })
+
+
+class Connection:
+    def __init__(self, user_id: int, websocket: WebSocket,
+                 max_queue: int = WS_SEND_QUEUE_SIZE, policy: str = WS_SLOW_CONSUMER_POLICY,
+                 transport: Transport = LEGACY):
+        self.user_id = user_id
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.policy = policy
+        self.transport = transport
+        self.codec = transport.codec
+        self.dropped = 0
+        self.closed = False
+        self._queue = deque()
+        # Pending presence diff (user_id -> is_online) and its encoded form
+        self._presence: Dict[int, bool] = {}
+        self._presence_payload: Optional[str] = None
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._writer())
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue) + len(self._presence)
+
+    def push(self, payload: str) -> bool:
+        # payload is JSON text; converted to this connection's encoding
+        return self.push_frame(self.codec.from_json(payload))
+
+    def push_frame(self, frame: Frame) -> bool:
+        if self.closed:
+            return False
+        if len(self._queue) >= self.max_queue:
+            return self._overflow()
+        self._queue.append(frame)
+        self._ready.set()
+        return True
+
+    async def receive(self):
+        # Clients may send text or (binary subprotocols) bytes frames
+        message = await self.websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        data = message.get("text")
+        return self.codec.decode(data if data is not None else message["bytes"])
+
+    def push_presence(self, changes: Dict[int, bool], payload: str) -> bool:
+        if self.closed:
+            return False
+        if self.policy == "coalesce":
+            # Only the latest state per user matters to the client, so fold
+            # a diff that hasn't been written yet into the new one
+            if self._presence:
+                self._presence.update(changes)
+                self._presence_payload = None
+            else:
+                self._presence = dict(changes)
+                self._presence_payload = payload
+            self._ready.set()
+            return True
+        return self.push(payload)
+
+    def _overflow(self) -> bool:
+        self.dropped += 1
+        WS_FRAMES_DROPPED.inc()
+        if self.policy == "disconnect":
+            self.close(code=1013)
+        return False
+
+    def close(self, code: int = 1000):
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.clear()
+        self._presence = {}
+        self._ready.set()
+        asyncio.create_task(self._close_socket(code))
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass  # Socket already gone
+
+    async def _writer(self):
+        try:
+            while not self.closed:
+                await self._ready.wait()
+                self._ready.clear()
+                while not self.closed and (self._queue or self._presence):
+                    # Whatever is already waiting goes out together, up to
+                    # the batch size the client negotiated (1 for legacy)
+                    frames = []
+                    while self._queue and len(frames) < self.transport.batch_size:
+                        frames.append(self._queue.popleft())
+                    if self._presence and len(frames) < self.transport.batch_size:
+                        payload = self._presence_payload or encode_presence_diff(self._presence)
+                        self._presence = {}
+                        self._presence_payload = None
+                        frames.append(self.codec.from_json(payload))
+                    await self._send(frames[0] if len(frames) == 1 else self.codec.batch(frames))
+        except Exception:
+            # A failed send means the client is gone; the receive loop
+            # will notice the disconnect and unregister us
+            self.closed = True
+            self._queue.clear()
+            self._presence = {}
+
+    async def _send(self, frame: Frame):
+        if self.codec.binary:
+            await self.websocket.send_bytes(frame)
+        else:
+            await self.websocket.send_text(frame)
+
+    async def stop(self):
+        self.closed = True
+        self._ready.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+
+class ConnectionManager:
+    # Every node publishes deliveries and presence changes to the broker and
+    # delivers whatever comes back to the sockets connected locally
+    def __init__(self, broker: Optional[Broker] = None):
+        self.node_id = uuid.uuid4().hex
+        self.broker = broker or create_broker()
+        self.connections: Dict[int, Connection] = {}
+        # user_id -> ids of the nodes the user is connected to
+        self._presence_nodes: Dict[int, Set[str]] = {}
+        # node id -> monotonic time we last heard from it
+        self._node_seen: Dict[str, float] = {}
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._started = False
+        self._start_lock = asyncio.Lock()
+        # Called with (user_id, is_online) whenever a user's overall state flips
+        self.on_presence_change: Optional[Callable[[int, bool], None]] = None
+
+    async def start(self):
+        async with self._start_lock:
+            if self._started:
+                return
+            await self.broker.start(self._on_event)
+            self._started = True
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        # Ask the other nodes who is connected to them
+        await self.broker.publish({"kind": "hello", "node": self.node_id})
+
+    async def stop(self):
+        if self._started:
+            self._started = False
+            self._heartbeat_task.cancel()
+            try:
+                await self._heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            await self.broker.stop()
+
+    @property
+    def healthy(self) -> bool:
+        return self._started and self.broker.connected
+
+    async def _heartbeat(self):
+        while True:
+            try:
+                await self.broker.publish({"kind": "heartbeat", "node": self.node_id})
+            except Exception as exc:
+                logger.warning("broker heartbeat failed", extra={"error": repr(exc)})
+            self._expire_nodes()
+            await asyncio.sleep(NODE_HEARTBEAT_SECONDS)
+
+    def _expire_nodes(self):
+        deadline = time.monotonic() - NODE_EXPIRY_SECONDS
+        for node_id in [node_id for node_id, seen in self._node_seen.items() if seen < deadline]:
+            del self._node_seen[node_id]
+            logger.warning("node stopped heartbeating, dropping its presence", extra={"node": node_id})
+            for user_id in [user_id for user_id, nodes in self._presence_nodes.items() if node_id in nodes]:
+                if self._apply_presence(node_id, user_id, False) and self.on_presence_change:
+                    self.on_presence_change(user_id, False)
+
+    async def connect(self, user_id: int, websocket: WebSocket) -> Connection:
+        await self.start()
+        transport = negotiate(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=transport.subprotocol)
+        previous = self.connections.get(user_id)
+        if previous is not None:
+            previous.close()
+            await previous.stop()
+        connection = Connection(user_id, websocket, transport=transport)
+        connection.start()
+        self.connections[user_id] = connection
+        return connection
+
+    async def disconnect(self, connection: Connection):
+        # A reconnect may already have replaced this connection
+        if self.connections.get(connection.user_id) is connection:
+            del self.connections[connection.user_id]
+        await connection.stop()
+
+    def is_online(self, user_id: int) -> bool:
+        # Connected to this node
+        return user_id in self.connections
+
+    def is_online_anywhere(self, user_id: int) -> bool:
+        return bool(self._presence_nodes.get(user_id))
+
+    def online_user_ids(self):
+        return list(self._presence_nodes.keys())
+
+    async def send(self, user_ids: Iterable[int], message: dict):
+        await self.send_encoded(user_ids, encode_text(message))
+
+    async def send_encoded(self, user_ids: Iterable[int], payload: str):
+        # Serialized once; every node shares the same payload between recipients
+        await self.broker.publish({
+            "kind": "deliver",
+            "node": self.node_id,
+            "recipients": list(user_ids),
+            "payload": payload
+        })
+
+    def send_local(self, user_ids: Iterable[int], message: dict) -> int:
+        return self._deliver_local(user_ids, encode_text(message))
+
+    async def set_presence(self, user_id: int, is_online: bool):
+        await self.broker.publish({
+            "kind": "presence",
+            "node": self.node_id,
+            "user_id": user_id,
+            "is_online": is_online
+        })
+
+    def _deliver_local(self, user_ids: Iterable[int], payload: str) -> int:
+        delivered = 0
+        # Converted once per encoding in use, not once per recipient
+        frames = {}
+        for user_id in user_ids:
+            connection = self.connections.get(user_id)
+            if connection is None:
+                continue
+            frame = frames.get(connection.codec.name)
+            if frame is None:
+                frame = frames[connection.codec.name] = connection.codec.from_json(payload)
+            if connection.push_frame(frame):
+                delivered += 1
+        return delivered
+
+    def _apply_presence(self, node_id: str, user_id: int, is_online: bool) -> bool:
+        nodes = self._presence_nodes.setdefault(user_id, set())
+        was_online = bool(nodes)
+        if is_online:
+            nodes.add(node_id)
+        else:
+            nodes.discard(node_id)
+            if not nodes:
+                del self._presence_nodes[user_id]
+        return was_online != bool(nodes)
+
+    async def _on_event(self, event: dict):
+        kind = event.get("kind")
+        if event.get("node") not in (None, self.node_id):
+            self._node_seen[event["node"]] = time.monotonic()
+        if kind == "deliver":
+            with WS_FANOUT_SECONDS.time():
+                self._deliver_local(event["recipients"], event["payload"])
+        elif kind == "presence":
+            user_id, is_online = event["user_id"], event["is_online"]
+            if self._apply_presence(event["node"], user_id, is_online) and self.on_presence_change:
+                self.on_presence_change(user_id, is_online)
+        elif kind == "hello" and event["node"] != self.node_id:
+            await self.broker.publish({
+                "kind": "presence_state",
+                "node": self.node_id,
+                "user_ids": list(self.connections.keys())
+            })
+        elif kind == "presence_state" and event["node"] != self.node_id:
+            for user_id in event["user_ids"]:
+                if self._apply_presence(event["node"], user_id, True) and self.on_presence_change:
+                    self.on_presence_change(user_id, True)
+
+
+manager = ConnectionManager()
+WS_CONNECTIONS.set_function(lambda: len(manager.connections))
+WS_SEND_QUEUE_DEPTH.set_function(lambda: sum(connection.queue_depth for connection in list(manager.connections.values())))
@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+from typing import Dict, FrozenSet, Optional, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+from starlette.concurrency import run_in_threadpool
+
+from ..database import SessionLocal
+from ..models.message import GroupMember
+
+# Commits made by this process update the index at once; this bounds how
+# long changes committed by other workers can go unseen
+GROUP_MEMBERS_CACHE_TTL = int(os.getenv("GROUP_MEMBERS_CACHE_TTL", "30"))  # seconds
+
+
+class GroupMembershipIndex:
+    # group_id -> frozenset of member user ids, loaded on first use and kept
+    # current from committed GroupMember changes; entries are reloaded
+    # after ttl seconds
+    def __init__(self, session_factory=SessionLocal, ttl: int = GROUP_MEMBERS_CACHE_TTL):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._groups: Dict[int, Tuple[float, FrozenSet[int]]] = {}
+        # Bumped on every change so a load racing with a commit is discarded
+        self._versions: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def members(self, group_id: int) -> FrozenSet[int]:
+        with self._lock:
+            members = self._cached(group_id)
+            if members is not None:
+                self.hits += 1
+                return members
+            self.misses += 1
+            version = self._versions.get(group_id, 0)
+        members = self._load(group_id)
+        with self._lock:
+            if self._versions.get(group_id, 0) == version:
+                self._groups[group_id] = (time.monotonic() + self.ttl, members)
+        return members
+
+    async def get_members(self, group_id: int) -> FrozenSet[int]:
+        members = self._cached(group_id)
+        if members is not None:
+            self.hits += 1
+            return members
+        return await run_in_threadpool(self.members, group_id)
+
+    def is_member(self, group_id: int, user_id: int) -> bool:
+        return user_id in self.members(group_id)
+
+    async def check_member(self, group_id: int, user_id: int) -> bool:
+        return user_id in await self.get_members(group_id)
+
+    def add(self, group_id: int, user_id: int):
+        with self._lock:
+            self._bump(group_id)
+            entry = self._groups.get(group_id)
+            if entry is not None:
+                self._groups[group_id] = (entry[0], entry[1] | {user_id})
+
+    def remove(self, group_id: int, user_id: int):
+        with self._lock:
+            self._bump(group_id)
+            entry = self._groups.get(group_id)
+            if entry is not None:
+                self._groups[group_id] = (entry[0], entry[1] - {user_id})
+
+    def invalidate(self, group_id: int):
+        with self._lock:
+            self._bump(group_id)
+            self._groups.pop(group_id, None)
+
+    def clear(self):
+        with self._lock:
+            for group_id in list(self._groups):
+                self._bump(group_id)
+            self._groups.clear()
+
+    def _cached(self, group_id: int) -> Optional[FrozenSet[int]]:
+        entry = self._groups.get(group_id)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[1]
+
+    def _bump(self, group_id: int):
+        self._versions[group_id] = self._versions.get(group_id, 0) + 1
+
+    def _load(self, group_id: int) -> FrozenSet[int]:
+        db = self.session_factory()
+        try:
+            rows = db.query(GroupMember.user_id).filter(GroupMember.group_id == group_id).all()
+            return frozenset(row[0] for row in rows)
+        finally:
+            db.close()
+
+
+group_index = GroupMembershipIndex()
+
+
+# Membership changes are staged per session during flush and applied to the
+# index only once the transaction commits
+def _stage(target, change):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("group_membership_changes", []).append(change)
+
+@event.listens_for(GroupMember, "after_insert")
+def _member_added(mapper, connection, target):
+    _stage(target, ("add", target.group_id, target.user_id))
+
+@event.listens_for(GroupMember, "after_delete")
+def _member_removed(mapper, connection, target):
+    _stage(target, ("remove", target.group_id, target.user_id))
+
+@event.listens_for(GroupMember, "after_update")
+def _member_changed(mapper, connection, target):
+    history = inspect(target).attrs.group_id.history
+    for group_id in set(history.deleted or ()) | {target.group_id}:
+        _stage(target, ("invalidate", group_id, None))
+
+@event.listens_for(Session, "after_commit")
+def _apply_membership_changes(session):
+    for action, group_id, user_id in session.info.pop("group_membership_changes", ()):
+        if action == "add":
+            group_index.add(group_id, user_id)
+        elif action == "remove":
+            group_index.remove(group_id, user_id)
+        else:
+            group_index.invalidate(group_id)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_membership_changes(session):
+    session.info.pop("group_membership_changes", None)
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import os
+from typing import List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from ..database import SessionLocal
+from ..models.message import Message
+from ..monitoring.metrics import MESSAGE_WRITER_QUEUE_DEPTH
+from .conversations import update_conversations
+
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", "100"))
+MESSAGE_BATCH_INTERVAL_MS = int(os.getenv("MESSAGE_BATCH_INTERVAL_MS", "10"))
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriter:
+    """Write-behind pipeline that groups inbound messages into bulk inserts.
+
+    A single flusher task drains the queue, so ids are assigned in the same
+    order messages were submitted. ``submit`` resolves only after the batch
+    containing the message has been committed.
+    """
+
+    def __init__(self, session_factory=SessionLocal,
+                 batch_size: int = MESSAGE_BATCH_SIZE,
+                 interval_ms: int = MESSAGE_BATCH_INTERVAL_MS):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.interval = interval_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self.running:
+            return
+        # Let everything already queued reach the database first
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, **fields) -> Message:
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((fields, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        try:
+            messages = await run_in_threadpool(self._write, [fields for fields, _ in batch])
+        except Exception as exc:
+            if len(batch) > 1:
+                # One bad row (wrong type, FK violation) must not fail the
+                # messages batched alongside it: retry them one at a time
+                logger.warning("message batch failed, writing rows individually",
+                               extra={"count": len(batch), "error": repr(exc)})
+                for item in batch:
+                    await self._flush([item])
+                return
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for (_, future), message in zip(batch, messages):
+            if not future.done():
+                future.set_result(message)
+
+    def _write(self, rows: List[dict]) -> List[Message]:
+        # Keep attributes loaded after commit so callers can read the
+        # rows without another round trip
+        db = self.session_factory(expire_on_commit=False)
+        try:
+            messages = [Message(**fields) for fields in rows]
+            db.add_all(messages)
+            db.flush()
+            update_conversations(db, messages)
+            db.commit()
+            return messages
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+message_writer = MessageWriter()
+MESSAGE_WRITER_QUEUE_DEPTH.set_function(lambda: message_writer._queue.qsize() if message_writer._queue else 0)
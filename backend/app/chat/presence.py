@@ -0,0 +1,124 @@
+import asyncio
+import os
+from typing import Dict, FrozenSet, Iterable, Optional
+
+from sqlalchemy.orm import aliased
+from starlette.concurrency import run_in_threadpool
+
+from ..database import SessionLocal
+from ..models.message import GroupMember
+from .serialization import encode_text
+from .delivery import ConnectionManager, Connection, encode_presence_diff, manager
+
+# all    - every connected user sees everyone's presence
+# groups - users only see presence of people they share a group with
+PRESENCE_SCOPES = ("all", "groups")
+PRESENCE_SCOPE = os.getenv("PRESENCE_SCOPE", "all")
+PRESENCE_FLUSH_MS = int(os.getenv("PRESENCE_FLUSH_MS", "250"))
+
+if PRESENCE_SCOPE not in PRESENCE_SCOPES:
+    raise ValueError(f"PRESENCE_SCOPE must be one of {PRESENCE_SCOPES}")
+
+
+def load_group_peers(user_id: int) -> FrozenSet[int]:
+    db = SessionLocal()
+    try:
+        peer = aliased(GroupMember)
+        rows = db.query(peer.user_id).join(
+            GroupMember, GroupMember.group_id == peer.group_id
+        ).filter(GroupMember.user_id == user_id, peer.user_id != user_id).distinct().all()
+        return frozenset(row[0] for row in rows)
+    finally:
+        db.close()
+
+
+class PresenceService:
+    # Batches presence flips into periodic diff frames instead of sending one
+    # frame per connect/disconnect to every socket
+    def __init__(self, connections: ConnectionManager = manager,
+                 scope: str = PRESENCE_SCOPE, flush_ms: int = PRESENCE_FLUSH_MS):
+        self.connections = connections
+        self.scope = scope
+        self.interval = flush_ms / 1000
+        self._pending: Dict[int, bool] = {}
+        self._peers: Dict[int, FrozenSet[int]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        connections.on_presence_change = self.record
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def record(self, user_id: int, is_online: bool):
+        self._pending[user_id] = is_online
+        self.start()
+        self._wakeup.set()
+
+    def is_online(self, user_id: int) -> bool:
+        return self.connections.is_online_anywhere(user_id)
+
+    async def visible_to(self, user_id: int) -> Iterable[int]:
+        online = self.connections.online_user_ids()
+        if self.scope == "all":
+            return [other for other in online if other != user_id]
+        peers = await self._get_peers(user_id)
+        return [other for other in online if other in peers]
+
+    async def connected(self, connection: Connection):
+        if self.scope == "groups":
+            self._peers[connection.user_id] = await run_in_threadpool(load_group_peers, connection.user_id)
+        # Compact snapshot so new clients don't have to wait for diffs
+        connection.push(encode_text({
+            "type": "presence_snapshot",
+            "online": list(await self.visible_to(connection.user_id))
+        }))
+
+    def disconnected(self, user_id: int):
+        if not self.connections.is_online(user_id):
+            self._peers.pop(user_id, None)
+
+    async def _get_peers(self, user_id: int) -> FrozenSet[int]:
+        peers = self._peers.get(user_id)
+        if peers is None:
+            peers = await run_in_threadpool(load_group_peers, user_id)
+        return peers
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Let a burst of connects/disconnects accumulate into one frame
+            await asyncio.sleep(self.interval)
+            self._wakeup.clear()
+            changes, self._pending = self._pending, {}
+            if changes:
+                self.flush(changes)
+
+    def flush(self, changes: Dict[int, bool]):
+        shared_payload = encode_presence_diff(changes)
+        for user_id, connection in list(self.connections.connections.items()):
+            if self.scope == "groups":
+                peers = self._peers.get(user_id, frozenset())
+                visible = {other: state for other, state in changes.items() if other in peers}
+            elif user_id in changes:
+                visible = {other: state for other, state in changes.items() if other != user_id}
+            else:
+                connection.push_presence(changes, shared_payload)
+                continue
+            if visible:
+                connection.push_presence(visible, encode_presence_diff(visible))
+
+
+presence = PresenceService()
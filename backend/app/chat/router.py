@@ -1,17 +1,34 @@
-from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List, Dict
-from ..database import get_db
+from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect, HTTPException, Query, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List
+from ..database import AsyncSessionLocal, get_async_db
 from ..models.user import User
-from ..models.message import Message, Group, GroupMember
-from ..auth.jwt import get_current_user
-from pydantic import BaseModel
-import json
+from ..models.message import Message, Group
+from ..models.conversation import Conversation
+from ..auth.jwt import authenticate_token, get_current_user
+from .delivery import manager
+from .persistence import message_writer
+from .presence import presence
+from .membership import group_index
+from .conversations import conversation_key, mark_read
+from . import search as message_search
+from .archive import paginate
+from .serialization import encode_messages, encode_with_messages, epoch_ms, message_payloads, now
+from .sync import MAX_SYNC_PAGE_SIZE, SYNC_PAGE_SIZE, fetch_updates
+from fastapi.responses import Response
+from pydantic import BaseModel, field_serializer
+import logging
 from datetime import datetime
 from typing import Optional
-import pytz
 
 router = APIRouter(tags=["Chat"])
+logger = logging.getLogger(__name__)
+
+HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_PAGE_SIZE = 200
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
 
 class MessageCreate(BaseModel):
     content: str
@@ -22,134 +39,332 @@ class MessageOut(BaseModel):
     id: int
     content: str
     sender_id: int
-    receiver_id: int
+    receiver_id: Optional[int] = None
     group_id: Optional[int] = None
-    created_at: datetime  # Stored as timezone-aware datetime
-    
+    created_at: datetime
+
+    # Same wire format as the pre-encoded history and WebSocket payloads
+    @field_serializer("created_at")
+    def _created_at(self, value: datetime) -> int:
+        return epoch_ms(value)
+
     class Config:
         from_attributes = True
-        json_encoders = {
-            datetime: lambda v: v.astimezone(pytz.timezone('Asia/Karachi')).isoformat()
-        }
 
-active_connections: Dict[int, WebSocket] = {}
-online_users: Dict[int, bool] = {}
+class ConversationOut(BaseModel):
+    peer_id: Optional[int] = None
+    group_id: Optional[int] = None
+    last_message_id: Optional[int] = None
+    last_message_preview: Optional[str] = None
+    last_sender_id: Optional[int] = None
+    last_message_at: Optional[datetime] = None
+    last_read_message_id: int
+    unread_count: int
+
+    @field_serializer("last_message_at")
+    def _last_message_at(self, value: Optional[datetime]) -> Optional[int]:
+        return epoch_ms(value)
+
+    class Config:
+        from_attributes = True
+
+class ConversationRead(BaseModel):
+    peer_id: Optional[int] = None
+    group_id: Optional[int] = None
+    message_id: Optional[int] = None
+
+class SyncOut(BaseModel):
+    messages: List[MessageOut]
+    last_id: int
+    has_more: bool
+
+class SearchHit(BaseModel):
+    message: MessageOut
+    snippet: str  # HTML-escaped, matches wrapped in <mark>
+
+class SearchOut(BaseModel):
+    results: List[SearchHit]
+    next_offset: Optional[int] = None
+
+def _sync_frame(messages: List[Message], has_more: bool, since_id: int) -> str:
+    return encode_with_messages(
+        messages,
+        type="sync",
+        last_id=messages[-1].id if messages else since_id,
+        has_more=has_more
+    ).decode()
+
+def _json_response(content: bytes) -> Response:
+    # Bodies built from cached payloads; skips response_model validation
+    return Response(content=content, media_type="application/json")
+
+def _invalid_message(message_data) -> Optional[str]:
+    # Checked before queueing so a malformed frame never reaches the writer
+    if not isinstance(message_data, dict):
+        return "Message must be an object"
+    if not isinstance(message_data.get("content"), str):
+        return "content must be a string"
+    for field in ("receiver_id", "group_id"):
+        value = message_data.get(field)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+            return f"{field} must be an integer"
+    if message_data.get("receiver_id") is None and not message_data.get("group_id"):
+        return "receiver_id or group_id is required"
+    return None
+
+def _invalid_resume(message_data: dict) -> Optional[str]:
+    # Same rules as the REST sync endpoint's query parameters
+    for field in ("last_id", "limit"):
+        value = message_data.get(field)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+            return f"{field} must be an integer"
+    if (message_data.get("last_id") or 0) < 0:
+        return "last_id cannot be negative"
+    return None
+
+async def _websocket_user(websocket: WebSocket, token: Optional[str]):
+    # Browsers can't set headers on a WebSocket, so they pass the access
+    # token as ?token=; other clients may send the usual header instead
+    if token is None:
+        scheme, _, credentials = websocket.headers.get("authorization", "").partition(" ")
+        if scheme.lower() == "bearer":
+            token = credentials
+    if not token:
+        return None
+    # A session of its own: a dependency would hold one for the socket's lifetime
+    async with AsyncSessionLocal() as db:
+        return await authenticate_token(token, db)
 
 @router.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: int, db: Session = Depends(get_db)):
-    await websocket.accept()
-    active_connections[user_id] = websocket
-    online_users[user_id] = True
+async def websocket_endpoint(websocket: WebSocket, user_id: int, token: Optional[str] = Query(None)):
+    # Checked before accepting, so nobody can send, resume or receive as
+    # another user
+    user = await _websocket_user(websocket, token)
+    if user is None or user.id != user_id:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    connection = await manager.connect(user_id, websocket)
     # Notify all connected users about this user coming online
-    for connection_user_id, ws in active_connections.items():
-        if connection_user_id != user_id:
-            try:
-                await ws.send_text(json.dumps({
-                    "type": "presence",
-                    "user_id": user_id,
-                    "is_online": True
-                }))
-            except:
-                pass  # Skip if sending fails
+    await manager.set_presence(user_id, True)
+    await presence.connected(connection)
     try:
         while True:
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
+            try:
+                message_data = await connection.receive()
+            except ValueError:
+                manager.send_local([user_id], {"type": "error", "detail": "Frame could not be decoded"})
+                continue
+            if isinstance(message_data, dict) and message_data.get("type") == "resume":
+                # Reconnect handshake: replay what was missed since last_id,
+                # one page per request; the client asks again while has_more
+                problem = _invalid_resume(message_data)
+                if problem:
+                    manager.send_local([user_id], {"type": "error", "detail": problem})
+                    continue
+                since_id = message_data.get("last_id") or 0
+                limit = max(1, min(message_data.get("limit") or SYNC_PAGE_SIZE, MAX_SYNC_PAGE_SIZE))
+                async with AsyncSessionLocal() as db:
+                    messages, has_more = await fetch_updates(db, user_id, since_id, limit)
+                connection.push(_sync_frame(messages, has_more, since_id))
+                continue
+            problem = _invalid_message(message_data)
+            if problem:
+                manager.send_local([user_id], {
+                    "type": "error",
+                    "client_id": message_data.get("client_id") if isinstance(message_data, dict) else None,
+                    "detail": problem
+                })
+                continue
+            group_id = message_data.get("group_id")
+            group_members = frozenset()
+            if group_id:
+                group_members = await group_index.get_members(group_id)
+                if user_id not in group_members:
+                    manager.send_local([user_id], {
+                        "type": "error",
+                        "client_id": message_data.get("client_id"),
+                        "detail": "You are not a member of this group"
+                    })
+                    continue
             
             # Save message with PKT time
-            pkt_time = datetime.now(pytz.timezone('Asia/Karachi'))
-            db_message = Message(
-                content=message_data["content"],
-                sender_id=user_id,
-                receiver_id=message_data.get("receiver_id"),
-                group_id=message_data.get("group_id"),
-                created_at=pkt_time
-            )
-            db.add(db_message)
-            db.commit()
-            db.refresh(db_message)
-            
-            # Format message with PKT time
-            message_out = {
-                "id": db_message.id,
-                "content": db_message.content,
-                "sender_id": db_message.sender_id,
-                "receiver_id": db_message.receiver_id,
-                "group_id": db_message.group_id,
-                "created_at": db_message.created_at.astimezone(
-                    pytz.timezone('Asia/Karachi')
-                ).strftime("%Y-%m-%d %I:%M:%S %p (PKT)")
-            }
+            pkt_time = now()
+            # Batched with other inbound messages; resolves once committed
+            try:
+                db_message = await message_writer.submit(
+                    content=message_data["content"],
+                    sender_id=user_id,
+                    receiver_id=message_data.get("receiver_id"),
+                    group_id=group_id,
+                    created_at=pkt_time
+                )
+            except Exception:
+                logger.exception("failed to store message", extra={"user_id": user_id})
+                manager.send_local([user_id], {
+                    "type": "error",
+                    "client_id": message_data.get("client_id"),
+                    "detail": "Message could not be stored"
+                })
+                continue
             
-            # Send to receiver/group members
-            if db_message.receiver_id in active_connections:
-                await active_connections[db_message.receiver_id].send_text(json.dumps(message_out))
-            if db_message.group_id:
-                group_members = db.query(GroupMember).filter(GroupMember.group_id == db_message.group_id).all()
-                for member in group_members:
-                    if member.user_id in active_connections and member.user_id != user_id:
-                        await active_connections[member.user_id].send_text(json.dumps(message_out))
+            # Encoded once; history reads of this message reuse the same bytes
+            payload = message_payloads.get(db_message).decode()
+
+            # Queue for receiver/group members; each connection has its own writer
+            recipients = set()
+            if db_message.receiver_id is not None:
+                recipients.add(db_message.receiver_id)
+            recipients.update(member_id for member_id in group_members if member_id != user_id)
+            await manager.send_encoded(recipients, payload)
+            if "client_id" in message_data:
+                # Confirm to the sender that the message is durable
+                manager.send_local([user_id], {
+                    "type": "ack",
+                    "client_id": message_data["client_id"],
+                    "id": db_message.id
+                })
     
     except WebSocketDisconnect:
-        if user_id in active_connections:
-            del active_connections[user_id]
-        if user_id in online_users:
-            online_users[user_id] = False
-        
-        # Notify all connected users about this user going offline
-        for connection_user_id, ws in active_connections.items():
-            if connection_user_id != user_id:
-                try:
-                    await ws.send_text(json.dumps({
-                        "type": "presence",
-                        "user_id": user_id,
-                        "is_online": False
-                    }))
-                except:
-                    pass  # Skip if sending fails
+        pass
+    finally:
+        await manager.disconnect(connection)
+        if not manager.is_online(user_id):
+            # Notify all connected users about this user going offline
+            await manager.set_presence(user_id, False)
+        presence.disconnected(user_id)
+
+@router.get("/presence")
+async def get_presence(current_user: User = Depends(get_current_user)):
+    return {"online": list(await presence.visible_to(current_user.id))}
+
+@router.get("/presence/{user_id}")
+def get_user_presence(user_id: int, current_user: User = Depends(get_current_user)):
+    return {"user_id": user_id, "is_online": presence.is_online(user_id)}
+
+@router.get("/sync", response_model=SyncOut)
+async def sync_messages(
+    since_id: int = Query(0, ge=0),
+    limit: int = Query(SYNC_PAGE_SIZE, ge=1, le=MAX_SYNC_PAGE_SIZE),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Everything newer than the client's last-seen id, across all DMs and groups
+    messages, has_more = await fetch_updates(db, current_user.id, since_id, limit)
+    return _json_response(encode_with_messages(
+        messages,
+        last_id=messages[-1].id if messages else since_id,
+        has_more=has_more
+    ))
+
+@router.get("/search", response_model=SearchOut)
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=200),
+    peer_id: Optional[int] = Query(None),
+    group_id: Optional[int] = Query(None),
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=MAX_SEARCH_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    if message_search.search_backend is None:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="Message search is not available")
+    # Fetch one extra hit to know whether another page exists
+    hits = await message_search.search_messages(db, current_user.id, q, limit + 1, offset, peer_id, group_id)
+    return {
+        "results": [{"message": message, "snippet": snippet} for message, snippet in hits[:limit]],
+        "next_offset": offset + limit if len(hits) > limit else None
+    }
 
 @router.get("/messages/{user_id}", response_model=List[MessageOut])
-def get_direct_messages(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    print(f"Fetching messages between {current_user.id} and {user_id}")
+async def get_direct_messages(
+    user_id: int,
+    before_id: Optional[int] = Query(None),
+    after_id: Optional[int] = Query(None),
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=MAX_HISTORY_PAGE_SIZE),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    logger.debug("fetching direct messages", extra={"user_id": current_user.id, "peer_id": user_id})
     if current_user.id == user_id:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cannot fetch messages with yourself")
-    if not db.query(User).filter(User.id == user_id).first():
+    if await db.get(User, user_id) is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    # if not db.query(Group).filter(Group.id == user_id).first():
-    #     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Group not found")
-    # if not db.query(GroupMember).filter(GroupMember.group_id == user_id, GroupMember.user_id == current_user.id).first():
-    #     raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not a member of this group")
-
-    # Fetch messages between the current user and the specified user
-    messages = db.query(Message).filter(
-        ((Message.sender_id == current_user.id) & (Message.receiver_id == user_id)) |
-        ((Message.sender_id == user_id) & (Message.receiver_id == current_user.id))
-    ).order_by(Message.created_at).all()
-    if not messages:
-        # raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No messages found")
-        return []
-
-    # Uncomment the following lines if you want to fetch messages for a group
-    # if not db.query(Group).filter(Group.id == user_id).first():
-    #     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Group not found")
-    # if not db.query(GroupMember).filter(GroupMember.group_id == user_id, GroupMember.user_id == current_user.id).first():
-    #     raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not a member of this group")
-    # Fetch messages for the group
 
-    
-    return messages
+    # One range scan per direction on (sender_id, receiver_id, id), merged here;
+    # an OR of both directions would defeat the index
+    sent = await paginate(
+        db, lambda table: (table.sender_id == current_user.id, table.receiver_id == user_id),
+        before_id, after_id, limit
+    )
+    received = await paginate(
+        db, lambda table: (table.sender_id == user_id, table.receiver_id == current_user.id),
+        before_id, after_id, limit
+    )
+    messages = sorted(sent + received, key=lambda message: message.id)
+    if after_id is not None and before_id is None:
+        return _json_response(encode_messages(messages[:limit]))
+    return _json_response(encode_messages(messages[-limit:]))
+
+@router.get("/groups/{group_id}/messages", response_model=List[MessageOut])
+async def get_group_messages(
+    group_id: int,
+    before_id: Optional[int] = Query(None),
+    after_id: Optional[int] = Query(None),
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=MAX_HISTORY_PAGE_SIZE),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    if await db.get(Group, group_id) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Group not found")
+    if not await group_index.check_member(group_id, current_user.id):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not a member of this group")
+
+    return _json_response(encode_messages(await paginate(
+        db, lambda table: (table.group_id == group_id,),
+        before_id, after_id, limit
+    )))
 
 @router.post("/messages", response_model=MessageOut)
-def create_message(message: MessageCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    print(datetime.utcnow())
-    db_message = Message(
-    content=message.content,
-    sender_id=current_user.id,
-    receiver_id=message.receiver_id,
-    group_id=message.group_id,
-    created_at=datetime.now(pytz.timezone('Asia/Karachi'))  # PKT time
-)
-    db.add(db_message)
-    db.commit()
-    db.refresh(db_message)
-    return db_message
\ No newline at end of file
+async def create_message(message: MessageCreate, current_user: User = Depends(get_current_user)):
+    if message.group_id and not await group_index.check_member(message.group_id, current_user.id):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not a member of this group")
+    # Same batched write path as WebSocket messages, conversation summaries included
+    return await message_writer.submit(
+        content=message.content,
+        sender_id=current_user.id,
+        receiver_id=message.receiver_id,
+        group_id=message.group_id,
+        created_at=now()  # PKT time
+    )
+
+@router.get("/conversations", response_model=List[ConversationOut])
+async def get_conversations(
+    before_id: Optional[int] = Query(None),
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=MAX_HISTORY_PAGE_SIZE),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Inbox ordered by latest activity, paged on last_message_id
+    query = select(Conversation).where(Conversation.user_id == current_user.id)
+    if before_id is not None:
+        query = query.where(Conversation.last_message_id < before_id)
+    query = query.order_by(Conversation.last_message_id.desc()).limit(limit)
+    return (await db.execute(query)).scalars().all()
+
+@router.post("/conversations/read", response_model=ConversationOut)
+async def mark_conversation_read(
+    read: ConversationRead,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    if (read.peer_id is None) == (read.group_id is None):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Specify exactly one of peer_id or group_id")
+    conversation = (await db.execute(select(Conversation).where(
+        Conversation.user_id == current_user.id,
+        Conversation.conversation_key == conversation_key(read.peer_id, read.group_id)
+    ))).scalar_one_or_none()
+    if not conversation:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Conversation not found")
+    await mark_read(db, conversation, read.message_id)
+    await db.commit()
+    return conversation
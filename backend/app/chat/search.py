@@ -0,0 +1,185 @@
+import html
+import logging
+import os
+import re
+from typing import List, Optional, Tuple
+
+from sqlalchemy import bindparam, select, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..database import engine
+from ..models.message import ArchivedMessage, Message
+
+# Postgres text search configuration; "simple" does no stemming, so it
+# behaves the same for every language people chat in
+SEARCH_TEXT_CONFIG = os.getenv("SEARCH_TEXT_CONFIG", "simple")
+SNIPPET_TOKENS = int(os.getenv("SEARCH_SNIPPET_TOKENS", "16"))
+
+# Highlight markers used inside the database; the snippet is HTML-escaped
+# afterwards and these become <mark> tags, so message content can't inject markup
+_START, _STOP = "\x02", "\x03"
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+logger = logging.getLogger(__name__)
+
+def _sqlite_schema(table: str) -> List[str]:
+    index = f"{table}_fts"
+    return [
+        # External-content index: stores only the inverted index, not a copy of the text
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5(
+            content, content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS {index}_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {index}(rowid, content) VALUES (new.id, new.content);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {index}_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO {index}({index}, rowid, content) VALUES ('delete', old.id, old.content);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {index}_update AFTER UPDATE OF content ON {table} BEGIN
+            INSERT INTO {index}({index}, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO {index}(rowid, content) VALUES (new.id, new.content);
+        END""",
+    ]
+
+# Archived messages leave messages_fts with their rows and are indexed again
+# as they land in messages_archive, so search covers both tables
+_TABLES = ("messages", "messages_archive")
+_MODELS = {"messages": Message, "messages_archive": ArchivedMessage}
+
+# Conversations the user can see: their DMs and groups they are a member of
+_SCOPE = """(m.sender_id = :user_id OR m.receiver_id = :user_id
+    OR m.group_id IN (SELECT group_id FROM group_members WHERE user_id = :user_id))"""
+
+search_backend: Optional[str] = None
+# Tables with a full-text index, searched together
+searchable_tables: Tuple[str, ...] = ()
+
+
+def install_search_index(bind=engine, create: bool = True) -> Optional[str]:
+    """Create the full-text index for the current database, if it has one.
+
+    SQLite gets FTS5 tables kept in step with ``messages`` and
+    ``messages_archive`` by triggers; Postgres gets GIN indexes on their
+    tsvectors. Both are maintained
+    by the database on every write, so the application never reindexes.
+    With ``create=False`` (schema managed by app.migrations) nothing is
+    created; search is enabled if the index is already there.
+    """
+    global search_backend, searchable_tables
+    dialect = bind.dialect.name
+    if dialect == "sqlite":
+        try:
+            with bind.begin() as connection:
+                existing = {row[0] for row in connection.execute(text(
+                    "SELECT name FROM sqlite_master WHERE name LIKE 'messages%_fts'"
+                ))}
+                for table in _TABLES if create else ():
+                    for statement in _sqlite_schema(table):
+                        connection.execute(text(statement))
+                    if f"{table}_fts" not in existing:
+                        # Index rows written before the index existed
+                        connection.execute(text(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')"))
+                        existing.add(f"{table}_fts")
+        except OperationalError as exc:
+            logger.warning("SQLite FTS5 unavailable, message search disabled", extra={"error": repr(exc)})
+            return None
+        searchable_tables = tuple(table for table in _TABLES if f"{table}_fts" in existing)
+        search_backend = "sqlite" if "messages" in searchable_tables else None
+    elif dialect == "postgresql":
+        if create:
+            with bind.begin() as connection:
+                for table in _TABLES:
+                    connection.execute(text(
+                        f"CREATE INDEX IF NOT EXISTS ix_{table}_content_fts ON {table} "
+                        f"USING GIN (to_tsvector('{SEARCH_TEXT_CONFIG}', coalesce(content, '')))"
+                    ))
+        # Without the index a query is slower, not wrong
+        searchable_tables = _TABLES
+        search_backend = "postgresql"
+    return search_backend
+
+
+def assume_search_index(bind=engine) -> Optional[str]:
+    """Enable search as the current schema defines it, without querying the database."""
+    global search_backend, searchable_tables
+    if bind.dialect.name in ("sqlite", "postgresql"):
+        search_backend, searchable_tables = bind.dialect.name, _TABLES
+    return search_backend
+
+
+def _fts5_query(query: str) -> str:
+    # Every word must match, the last one as a prefix (search-as-you-type);
+    # quoting keeps user input out of the FTS5 query syntax
+    tokens = _TOKEN.findall(query)
+    if not tokens:
+        return ""
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def _highlight(snippet: Optional[str]) -> str:
+    return html.escape(snippet or "").replace(_START, "<mark>").replace(_STOP, "</mark>")
+
+
+async def search_messages(db: AsyncSession, user_id: int, query: str, limit: int, offset: int = 0,
+                          peer_id: Optional[int] = None,
+                          group_id: Optional[int] = None) -> List[Tuple[Message, str]]:
+    """Ranked matches in the user's conversations, archived ones included,
+    best first, with highlighted snippets."""
+    params = {"user_id": user_id, "limit": limit, "offset": offset,
+              "peer_id": peer_id, "group_id": group_id, "start": _START, "stop": _STOP}
+    filters = _SCOPE
+    if peer_id is not None:
+        filters += """ AND ((m.sender_id = :user_id AND m.receiver_id = :peer_id)
+            OR (m.sender_id = :peer_id AND m.receiver_id = :user_id))"""
+    if group_id is not None:
+        filters += " AND m.group_id = :group_id"
+
+    # Rank on ids alone; snippets are built afterwards for the returned page
+    # only, since they cost far more than the match itself
+    if search_backend == "sqlite":
+        params["query"] = _fts5_query(query)
+        if not params["query"]:
+            return []
+        # bm25 is lower for better matches
+        ranked = " UNION ALL ".join(f"""SELECT m.id AS id, '{table}' AS source, bm25({table}_fts) AS rank
+            FROM {table}_fts JOIN {table} m ON m.id = {table}_fts.rowid
+            WHERE {table}_fts MATCH :query AND {filters}""" for table in searchable_tables)
+        order = "rank, id DESC"
+
+        def snippets(table: str) -> str:
+            return f"""SELECT rowid, snippet({table}_fts, 0, :start, :stop, '…', {SNIPPET_TOKENS})
+                FROM {table}_fts WHERE {table}_fts MATCH :query AND rowid IN :ids"""
+    elif search_backend == "postgresql":
+        params["query"] = query
+        document = f"to_tsvector('{SEARCH_TEXT_CONFIG}', coalesce(m.content, ''))"
+        ranked = " UNION ALL ".join(f"""SELECT m.id AS id, '{table}' AS source, ts_rank({document}, q) AS rank
+            FROM {table} m, plainto_tsquery('{SEARCH_TEXT_CONFIG}', :query) q
+            WHERE {document} @@ q AND {filters}""" for table in searchable_tables)
+        order = "rank DESC, id DESC"
+
+        def snippets(table: str) -> str:
+            return f"""SELECT m.id, ts_headline('{SEARCH_TEXT_CONFIG}', m.content, q,
+                    'StartSel=' || :start || ', StopSel=' || :stop || ', MaxWords={SNIPPET_TOKENS}, MinWords=1')
+                FROM {table} m, plainto_tsquery('{SEARCH_TEXT_CONFIG}', :query) q WHERE m.id IN :ids"""
+    else:
+        raise RuntimeError("Message search is not available on this database")
+    sql = f"SELECT id, source FROM ({ranked}) AS hits ORDER BY {order} LIMIT :limit OFFSET :offset"
+
+    hits = (await db.execute(text(sql), params)).all()
+    messages, highlights = {}, {}
+    for table in searchable_tables:
+        ids = [message_id for message_id, source in hits if source == table]
+        if not ids:
+            continue
+        model = _MODELS[table]
+        messages.update((message.id, message) for message in (await db.execute(
+            select(model).where(model.id.in_(ids))
+        )).scalars())
+        highlights.update((await db.execute(
+            text(snippets(table)).bindparams(bindparam("ids", expanding=True)), {**params, "ids": ids}
+        )).all())
+    return [(messages[message_id], _highlight(highlights.get(message_id)))
+            for message_id, _ in hits if message_id in messages]
@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Iterable, Optional
+
+import pytz
+from sqlalchemy import event
+
+from ..models.message import Message
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+# Resolved once; every message timestamp goes through these
+PKT = pytz.timezone("Asia/Karachi")
+# Timezone of naive datetimes read back from the database (SQLite drops
+# the offset, and messages are stamped in PKT)
+STORAGE_TIMEZONE = pytz.timezone(os.getenv("STORAGE_TIMEZONE", "Asia/Karachi"))
+
+MESSAGE_PAYLOAD_CACHE_SIZE = int(os.getenv("MESSAGE_PAYLOAD_CACHE_SIZE", "50000"))
+
+
+def encode(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def encode_text(obj) -> str:
+    return encode(obj).decode()
+
+
+def decode(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def now() -> datetime:
+    return datetime.now(PKT)
+
+
+def epoch_ms(value: Optional[datetime]) -> Optional[int]:
+    """Wire timestamp: milliseconds since the epoch, formatted by the client."""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = STORAGE_TIMEZONE.localize(value)
+    return int(value.timestamp() * 1000)
+
+
+def message_dict(message: Message) -> dict:
+    return {
+        "id": message.id,
+        "content": message.content,
+        "sender_id": message.sender_id,
+        "receiver_id": message.receiver_id,
+        "group_id": message.group_id,
+        "created_at": epoch_ms(message.created_at),
+    }
+
+
+class MessagePayloadCache:
+    """Encoded JSON per message id; messages never change once written.
+
+    History, sync and live WebSocket delivery all reuse the same bytes, so
+    a message is serialized once however many times it is read.
+    """
+
+    def __init__(self, max_size: int = MESSAGE_PAYLOAD_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, message: Message) -> bytes:
+        with self._lock:
+            payload = self._entries.get(message.id)
+            if payload is not None:
+                self._entries.move_to_end(message.id)
+                self.hits += 1
+                return payload
+            self.misses += 1
+        payload = encode(message_dict(message))
+        if self.max_size:
+            with self._lock:
+                self._entries[message.id] = payload
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return payload
+
+    def invalidate(self, message_id: int):
+        with self._lock:
+            self._entries.pop(message_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+message_payloads = MessagePayloadCache()
+
+
+@event.listens_for(Message, "after_update")
+@event.listens_for(Message, "after_delete")
+def _invalidate_cached_payload(mapper, connection, target):
+    message_payloads.invalidate(target.id)
+
+
+def encode_messages(messages: Iterable[Message]) -> bytes:
+    return b"[" + b",".join(message_payloads.get(message) for message in messages) + b"]"
+
+
+def encode_with_messages(messages: Iterable[Message], **fields) -> bytes:
+    """``{"messages": [...], **fields}`` with the messages spliced in pre-encoded."""
+    rest = encode(fields)
+    head = b'{"messages":' + encode_messages(messages)
+    return head + (b"," + rest[1:] if fields else b"}")
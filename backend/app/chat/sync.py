@@ -0,0 +1,51 @@
+import os
+from typing import List, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..models.conversation import Conversation
+from ..models.message import Message
+from .archive import paginate
+from .membership import group_index
+
+SYNC_PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", "200"))
+MAX_SYNC_PAGE_SIZE = int(os.getenv("MAX_SYNC_PAGE_SIZE", "1000"))
+
+
+async def _newer(db: AsyncSession, since_id: int, limit: int, criteria) -> List[Message]:
+    # Reaches into the archive only for cursors older than the hot window
+    return await paginate(db, criteria, None, since_id, limit)
+
+
+async def fetch_updates(db: AsyncSession, user_id: int, since_id: int,
+                        limit: int = SYNC_PAGE_SIZE) -> Tuple[List[Message], bool]:
+    """Messages newer than ``since_id`` across every DM and group of a user.
+
+    The conversation summaries tell us which conversations moved past the
+    cursor, so an idle reconnect costs one index probe and each active
+    conversation one range scan. Returns the page (ascending ids) and
+    whether more remain after it.
+    """
+    changed = (await db.execute(select(Conversation).where(
+        Conversation.user_id == user_id,
+        Conversation.last_message_id > since_id
+    ))).scalars().all()
+
+    messages: List[Message] = []
+    for conversation in changed:
+        if conversation.group_id:
+            if not await group_index.check_member(conversation.group_id, user_id):
+                continue
+            messages += await _newer(db, since_id, limit + 1,
+                                     lambda table: (table.group_id == conversation.group_id,))
+        else:
+            messages += await _newer(db, since_id, limit + 1, lambda table: (
+                table.sender_id == user_id, table.receiver_id == conversation.peer_id))
+            if conversation.peer_id != user_id:
+                messages += await _newer(db, since_id, limit + 1, lambda table: (
+                    table.sender_id == conversation.peer_id, table.receiver_id == user_id))
+
+    messages.sort(key=lambda message: message.id)
+    return messages[:limit], len(messages) > limit
+
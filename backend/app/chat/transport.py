@@ -0,0 +1,92 @@
+import os
+from typing import Dict, List, Optional, Sequence, Union
+
+from .serialization import decode
+
+try:
+    import msgpack
+except ImportError:  # optional; the binary subprotocol is offered only when installed
+    msgpack = None
+
+# Most frames folded into one batch frame; only frames already waiting in
+# a connection's queue are batched, so batching never delays a send
+WS_BATCH_MAX_FRAMES = int(os.getenv("WS_BATCH_MAX_FRAMES", "64"))
+# permessage-deflate is negotiated by the server (uvicorn) with each
+# client; python -m app.main passes this through
+WS_PER_MESSAGE_DEFLATE = os.getenv("WS_PER_MESSAGE_DEFLATE", "1") == "1"
+
+Frame = Union[str, bytes]
+
+
+class JsonCodec:
+    """Text frames. Payloads are already JSON, so conversion is free."""
+
+    name = "json"
+    binary = False
+
+    def from_json(self, payload: str) -> str:
+        return payload
+
+    def decode(self, data: Frame):
+        return decode(data)
+
+    def batch(self, frames: Sequence[str]) -> str:
+        # Spliced, not re-encoded
+        return '{"type":"batch","frames":[' + ",".join(frames) + "]}"
+
+
+class MsgpackCodec:
+    """Binary MessagePack frames: smaller, and cheaper for clients to parse."""
+
+    name = "msgpack"
+    binary = True
+
+    def __init__(self):
+        self._batch_prefix = msgpack.packb("type") + msgpack.packb("batch") + msgpack.packb("frames")
+
+    def from_json(self, payload: str) -> bytes:
+        return msgpack.packb(decode(payload))
+
+    def decode(self, data: Frame):
+        if isinstance(data, str):
+            return decode(data)
+        return msgpack.unpackb(data)
+
+    def batch(self, frames: Sequence[bytes]) -> bytes:
+        # A packed array is its header followed by the packed items, so
+        # already-encoded frames are spliced in as they are
+        packer = msgpack.Packer()
+        return (packer.pack_map_header(2) + self._batch_prefix
+                + packer.pack_array_header(len(frames)) + b"".join(frames))
+
+
+JSON = JsonCodec()
+
+# Sec-WebSocket-Protocol values we accept; clients list them in their own
+# order of preference. v2 clients understand batch frames; clients that ask
+# for no subprotocol get the original one JSON text frame per event.
+SUBPROTOCOLS: Dict[str, object] = {}
+if msgpack is not None:
+    SUBPROTOCOLS["chat.v2.msgpack"] = MsgpackCodec()
+SUBPROTOCOLS["chat.v2.json"] = JSON
+
+
+class Transport:
+    __slots__ = ("subprotocol", "codec", "batch_size")
+
+    def __init__(self, subprotocol: Optional[str], codec, batch_size: int):
+        self.subprotocol = subprotocol
+        self.codec = codec
+        self.batch_size = batch_size
+
+
+LEGACY = Transport(None, JSON, 1)
+
+
+def negotiate(offered: List[str]) -> Transport:
+    """Pick the client's first offered subprotocol that we support."""
+    for subprotocol in offered:
+        codec = SUBPROTOCOLS.get(subprotocol)
+        if codec is not None:
+            return Transport(subprotocol, codec, WS_BATCH_MAX_FRAMES)
+    return LEGACY
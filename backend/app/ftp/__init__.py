@@ -0,0 +1,6 @@
+import os
+
+# Run the FTP server inside the API process; set to 0 when it runs as its
+# own process (python -m app.ftp.server). Kept here so the API can decide
+# without importing pyftpdlib.
+FTP_EMBEDDED = os.getenv("FTP_EMBEDDED", "1") == "1"
@@ -0,0 +1,103 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from typing import Dict
+
+from pyftpdlib.authorizers import AuthenticationFailed, DummyAuthorizer
+from sqlalchemy import event, inspect
+
+from ..auth.hashing import pwd_context
+from ..database import SessionLocal
+from ..models.user import User
+
+FTP_USER_PERM = "elradfmwM"
+FTP_AUTH_CACHE_TTL = int(os.getenv("FTP_AUTH_CACHE_TTL", "300"))  # seconds
+
+
+class DatabaseAuthorizer(DummyAuthorizer):
+    """Authorizer that checks FTP logins against the users table on demand.
+
+    Nothing is loaded at startup: a user is added to the virtual user table
+    (and gets a home directory) the first time they log in, and successful
+    logins are remembered for ``FTP_AUTH_CACHE_TTL`` seconds so repeat
+    connections skip the DB lookup and bcrypt.
+    """
+
+    def __init__(self, root_dir: str, session_factory=SessionLocal,
+                 perm: str = FTP_USER_PERM, cache_ttl: int = FTP_AUTH_CACHE_TTL):
+        super().__init__()
+        self.root_dir = root_dir
+        self.session_factory = session_factory
+        self.perm = perm
+        self.cache_ttl = cache_ttl
+        # Only a keyed digest of the password is kept, never the password
+        self._secret = os.urandom(32)
+        self._verified: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def _digest(self, username: str, password: str) -> bytes:
+        return hmac.new(self._secret, f"{username}\0{password}".encode(), hashlib.sha256).digest()
+
+    def _is_cached(self, username: str, password: str) -> bool:
+        with self._lock:
+            entry = self._verified.get(username)
+        if entry is None:
+            return False
+        deadline, digest = entry
+        if deadline <= time.monotonic():
+            self.forget(username)
+            return False
+        return hmac.compare_digest(digest, self._digest(username, password))
+
+    def forget(self, username: str):
+        with self._lock:
+            self._verified.pop(username, None)
+
+    def validate_authentication(self, username, password, handler):
+        if username == "anonymous":
+            return super().validate_authentication(username, password, handler)
+        if self._is_cached(username, password):
+            self._register(username)
+            return
+        db = self.session_factory()
+        try:
+            user = db.query(User).filter(User.username == username).first()
+        finally:
+            db.close()
+        if user is None or not user.is_active or not pwd_context.verify(password, user.hashed_password):
+            raise AuthenticationFailed("Authentication failed.")
+        with self._lock:
+            self._verified[username] = (time.monotonic() + self.cache_ttl, self._digest(username, password))
+        self._register(username)
+
+    def _register(self, username: str):
+        # Home directories are created lazily on first login
+        home = os.path.join(self.root_dir, username)
+        os.makedirs(home, exist_ok=True)
+        with self._lock:
+            if not self.has_user(username):
+                self.add_user(username, "", home, perm=self.perm)
+
+    def get_home_dir(self, username):
+        if not self.has_user(username):
+            raise AuthenticationFailed("Authentication failed.")
+        return super().get_home_dir(username)
+
+
+_authorizers = []
+
+
+def register_authorizer(authorizer: DatabaseAuthorizer):
+    _authorizers.append(authorizer)
+
+
+# A changed or deleted user has to log in with the database again
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _forget_ftp_login(mapper, connection, target):
+    usernames = {target.username} | set(inspect(target).attrs.username.history.deleted or ())
+    for authorizer in _authorizers:
+        for username in usernames:
+            authorizer.forget(username)
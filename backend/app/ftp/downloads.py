@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import NamedTuple, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..models.file import File as FileModel
+
+FILE_METADATA_CACHE_SIZE = int(os.getenv("FILE_METADATA_CACHE_SIZE", "10000"))
+FILE_METADATA_CACHE_TTL = int(os.getenv("FILE_METADATA_CACHE_TTL", "300"))  # seconds
+# Blob-backed files never change, so clients may reuse them for this long
+DOWNLOAD_MAX_AGE = int(os.getenv("DOWNLOAD_MAX_AGE", "86400"))
+
+
+class FileMeta(NamedTuple):
+    id: int
+    filename: str
+    path: str
+    size: int
+    content_hash: Optional[str]
+    uploaded_by: int
+    received_by: Optional[int]
+
+    @classmethod
+    def from_file(cls, file: FileModel) -> "FileMeta":
+        return cls(file.id, file.filename, file.path, file.size, file.content_hash,
+                   file.uploaded_by, file.received_by)
+
+    def can_access(self, user_id: int) -> bool:
+        return user_id in (self.uploaded_by, self.received_by)
+
+
+class FileMetadataCache:
+    def __init__(self, max_size: int = FILE_METADATA_CACHE_SIZE, ttl: int = FILE_METADATA_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, db: AsyncSession, file_id: int) -> Optional[FileMeta]:
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(file_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        file = await db.get(FileModel, file_id)
+        if file is None:
+            return None
+        meta = FileMeta.from_file(file)
+        with self._lock:
+            self._entries[file_id] = (time.monotonic() + self.ttl, meta)
+            self._entries.move_to_end(file_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return meta
+
+    def invalidate(self, file_id: int):
+        with self._lock:
+            self._entries.pop(file_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+file_metadata_cache = FileMetadataCache()
+
+
+@event.listens_for(FileModel, "after_update")
+@event.listens_for(FileModel, "after_delete")
+def _invalidate_cached_file(mapper, connection, target):
+    file_metadata_cache.invalidate(target.id)
+
+
+def strong_etag(meta: FileMeta) -> Optional[str]:
+    # Only content-addressed files have a validator that is stable across
+    # servers; legacy rows fall back to Starlette's mtime/size etag
+    if meta.content_hash:
+        return f'"sha256-{meta.content_hash}"'
+    return None
+
+
+def last_modified(stat_result: os.stat_result) -> str:
+    return formatdate(stat_result.st_mtime, usegmt=True)
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison
+    candidates = (tag.strip() for tag in header.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def is_not_modified(request_headers, etag: Optional[str], stat_result: os.stat_result) -> bool:
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence over If-Modified-Since (RFC 9110 13.2.2)
+        return etag is not None and _etag_matches(if_none_match, etag)
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(stat_result.st_mtime) <= since
+    return False
@@ -0,0 +1,108 @@
+import os
+from typing import Optional
+
+from sqlalchemy import delete, event, func, insert, inspect, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..database import SessionLocal
+from ..models.file import File, StorageUsage
+
+# Bytes of recorded files each user may own; 0 = unlimited. Forwarded and
+# deduplicated files count at their full size, like the listings show them.
+STORAGE_QUOTA_MB = int(os.getenv("STORAGE_QUOTA_MB", "0"))
+STORAGE_QUOTA_BYTES = STORAGE_QUOTA_MB * 1024 * 1024
+
+_UPSERTS = {"sqlite": sqlite_insert, "postgresql": postgresql_insert}
+
+
+class StorageQuotaExceeded(Exception):
+    pass
+
+
+def _add_usage(connection, user_id: int, size: int, count: int = 1):
+    upsert = _UPSERTS.get(connection.dialect.name)
+    if upsert is not None:
+        statement = upsert(StorageUsage).values(user_id=user_id, bytes_used=size, file_count=count)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[StorageUsage.user_id],
+            set_={"bytes_used": StorageUsage.bytes_used + size, "file_count": StorageUsage.file_count + count}
+        ))
+        return
+    updated = connection.execute(update(StorageUsage).where(StorageUsage.user_id == user_id).values(
+        bytes_used=StorageUsage.bytes_used + size, file_count=StorageUsage.file_count + count
+    ))
+    if not updated.rowcount:
+        connection.execute(insert(StorageUsage).values(user_id=user_id, bytes_used=size, file_count=count))
+
+
+@event.listens_for(File, "after_insert")
+def _count_recorded_file(mapper, connection, target):
+    # Same transaction as the files row, for API and FTP uploads alike
+    if target.uploaded_by is not None:
+        _add_usage(connection, target.uploaded_by, target.size or 0)
+
+@event.listens_for(File, "after_update")
+def _recount_changed_file(mapper, connection, target):
+    # A file overwritten in place keeps its row; move the difference
+    state = inspect(target)
+    sizes, owners = state.attrs.size.history, state.attrs.uploaded_by.history
+    if not sizes.has_changes() and not owners.has_changes():
+        return
+    old_size = (sizes.deleted[0] if sizes.deleted else target.size) or 0
+    old_owner = owners.deleted[0] if owners.deleted else target.uploaded_by
+    new_size = target.size or 0
+    if old_owner == target.uploaded_by:
+        if old_owner is not None and new_size != old_size:
+            _add_usage(connection, old_owner, new_size - old_size, 0)
+        return
+    if old_owner is not None:
+        _add_usage(connection, old_owner, -old_size, -1)
+    if target.uploaded_by is not None:
+        _add_usage(connection, target.uploaded_by, new_size)
+
+
+async def storage_used(db: AsyncSession, user_id: int) -> dict:
+    row = (await db.execute(
+        select(StorageUsage.bytes_used, StorageUsage.file_count).where(StorageUsage.user_id == user_id)
+    )).first()
+    return {
+        "bytes_used": row.bytes_used if row else 0,
+        "file_count": row.file_count if row else 0,
+        "quota_bytes": STORAGE_QUOTA_BYTES or None,
+    }
+
+
+async def ensure_quota(db: AsyncSession, user_id: int, size: Optional[int]):
+    """Raise ``StorageQuotaExceeded`` if ``size`` more bytes would not fit."""
+    if not STORAGE_QUOTA_BYTES:
+        return
+    used = (await db.execute(
+        select(StorageUsage.bytes_used).where(StorageUsage.user_id == user_id)
+    )).scalar() or 0
+    if used + (size or 0) > STORAGE_QUOTA_BYTES:
+        raise StorageQuotaExceeded(
+            f"Storage quota exceeded: {used} of {STORAGE_QUOTA_BYTES} bytes used"
+        )
+
+
+def rebuild_storage_usage():
+    """Recompute every user's usage from the files table (backfill or repair)."""
+    db = SessionLocal()
+    try:
+        db.execute(delete(StorageUsage))
+        db.execute(insert(StorageUsage).from_select(
+            ["user_id", "bytes_used", "file_count"],
+            select(File.uploaded_by, func.coalesce(func.sum(File.size), 0), func.count(File.id))
+            .where(File.uploaded_by.isnot(None))
+            .group_by(File.uploaded_by)
+        ))
+        db.commit()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    from ..models import message, user  # noqa: F401 - File's relationships need these mapped
+    rebuild_storage_usage()
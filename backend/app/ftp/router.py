@@ -1,20 +1,25 @@
-from fastapi import APIRouter, Depends, File, UploadFile, HTTPException, status, Form
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, File, UploadFile, HTTPException, Query, Request, status, Form
+from fastapi.responses import FileResponse, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, List, Optional
+import logging
 import os
-import shutil
+from starlette.concurrency import run_in_threadpool
 
-from ..database import get_db
+from ..database import get_async_db
 from ..models.user import User
 from ..models.file import File as FileModel
 from ..auth.jwt import get_current_user
+from .storage import UPLOAD_CHUNK_SIZE, blob_store
+from .quota import StorageQuotaExceeded, ensure_quota, storage_used
+from .uploads import UploadSessionError, upload_sessions
+from .downloads import DOWNLOAD_MAX_AGE, file_metadata_cache, is_not_modified, last_modified, strong_etag
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import datetime, timezone
 
 router = APIRouter(tags=["Files"])
-
-ROOT_DIR = "./ftp_data"
+logger = logging.getLogger(__name__)
 
 class FileOut(BaseModel):
     id: int
@@ -24,74 +29,291 @@ class FileOut(BaseModel):
     uploaded_at: datetime
     
     class Config:
-        form_attribute = True
+        from_attributes = True
+
+class StorageUsageOut(BaseModel):
+    bytes_used: int
+    file_count: int
+    quota_bytes: Optional[int] = None
+
+FILE_PAGE_SIZE = 50
+MAX_FILE_PAGE_SIZE = 200
+
+async def _check_quota(db: AsyncSession, user_id: int, size: Optional[int]):
+    try:
+        await ensure_quota(db, user_id, size)
+    except StorageQuotaExceeded as exc:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(exc))
+
+async def _record_file(db: AsyncSession, **fields):
+    db_file = FileModel(**fields)
+    db.add(db_file)
+    await db.commit()
+    await db.refresh(db_file)
+    return db_file
 
 @router.post("/upload", response_model=FileOut)
 async def upload_file(
     file: UploadFile = File(...),
     recipient_id: int = Form(...),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    user_dir = os.path.join(ROOT_DIR, current_user.username)
-    os.makedirs(user_dir, exist_ok=True)
+    # The multipart body is already spooled, so its size is known up front
+    await _check_quota(db, current_user.id, file.size)
+    # Copy, hash and dedupe on a worker thread so the event loop stays free
+    stored = await run_in_threadpool(blob_store.store, file.file)
+    logger.debug("file uploaded", extra={"user_id": current_user.id, "recipient_id": recipient_id,
+                                         "size": stored.size})
+    return await _record_file(
+        db,
+        filename=file.filename,
+        path=stored.path,
+        size=stored.size,
+        content_hash=stored.digest,
+        uploaded_by=current_user.id,
+        received_by=recipient_id  # set recipient
+    )
 
-    file_path = os.path.join(user_dir, file.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
 
-    file_size = os.path.getsize(file_path)
-    print("Receipt id:", recipient_id)
-    db_file = FileModel(
+@router.post("/files/{file_id}/forward", response_model=FileOut)
+async def forward_file(
+    file_id: int,
+    recipient_id: int = Form(...),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    file = await db.get(FileModel, file_id)
+    if not file:
+        raise HTTPException(status_code=404, detail="File not found")
+    if file.uploaded_by != current_user.id and file.received_by != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this file")
+    await _check_quota(db, current_user.id, file.size)
+    # The new row shares the stored blob, so forwarding costs no disk I/O
+    return await _record_file(
+        db,
         filename=file.filename,
-        path=file_path,
-        size=file_size,
+        path=file.path,
+        size=file.size,
+        content_hash=file.content_hash,
         uploaded_by=current_user.id,
-        received_by=recipient_id  # set recipient
+        received_by=recipient_id
     )
-    db.add(db_file)
-    db.commit()
-    db.refresh(db_file)
 
-    return db_file
 
+class UploadSessionCreate(BaseModel):
+    filename: str
+    recipient_id: int
+    size: Optional[int] = None
+
+class UploadSessionOut(BaseModel):
+    upload_id: str
+    filename: str
+    recipient_id: int
+    size: Optional[int] = None
+    offset: int
+
+def _get_upload_session(upload_id: str, current_user: User) -> dict:
+    try:
+        session = upload_sessions.get(upload_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    if session["user_id"] != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this upload")
+    return session
+
+def _write_chunk(part, data: bytes):
+    part.write(data)
+
+@router.post("/uploads", response_model=UploadSessionOut)
+async def create_upload_session(
+    upload: UploadSessionCreate,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    if upload.size is not None and upload.size < 0:
+        raise HTTPException(status_code=400, detail="Size cannot be negative")
+    # Refuse up front rather than after the client has sent every chunk
+    await _check_quota(db, current_user.id, upload.size)
+    return await run_in_threadpool(
+        upload_sessions.create, current_user.id, upload.recipient_id, upload.filename, upload.size
+    )
+
+@router.get("/uploads/{upload_id}", response_model=UploadSessionOut)
+def get_upload_session(upload_id: str, current_user: User = Depends(get_current_user)):
+    return _get_upload_session(upload_id, current_user)
+
+@router.put("/uploads/{upload_id}", response_model=UploadSessionOut)
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    current_user: User = Depends(get_current_user)
+):
+    session = await run_in_threadpool(_get_upload_session, upload_id, current_user)
+    # The part file stays locked until closed, so two chunk requests can't
+    # interleave writes; the second one gets a 409 and retries
+    try:
+        part = await run_in_threadpool(upload_sessions.open_at, upload_id, offset)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    except UploadSessionError as exc:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(exc))
+    written = offset
+    try:
+        buffer = bytearray()
+        async for chunk in request.stream():
+            written += len(chunk)
+            if session["size"] is not None and written > session["size"]:
+                raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                    detail="Chunk runs past the declared upload size")
+            buffer += chunk
+            if len(buffer) >= UPLOAD_CHUNK_SIZE:
+                await run_in_threadpool(_write_chunk, part, bytes(buffer))
+                buffer.clear()
+        if buffer:
+            await run_in_threadpool(_write_chunk, part, bytes(buffer))
+    finally:
+        await run_in_threadpool(part.close)
+    session["offset"] = written
+    return session
+
+@router.post("/uploads/{upload_id}/complete", response_model=FileOut)
+async def complete_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    session = await run_in_threadpool(_get_upload_session, upload_id, current_user)
+    await _check_quota(db, current_user.id, session["offset"])
+    try:
+        stored = await run_in_threadpool(upload_sessions.finalize, upload_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    except UploadSessionError as exc:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(exc))
+    return await _record_file(
+        db,
+        filename=session["filename"],
+        path=stored.path,
+        size=stored.size,
+        content_hash=stored.digest,
+        uploaded_by=current_user.id,
+        received_by=session["recipient_id"]
+    )
+
+@router.delete("/uploads/{upload_id}")
+def abort_upload(upload_id: str, current_user: User = Depends(get_current_user)):
+    _get_upload_session(upload_id, current_user)
+    upload_sessions.delete(upload_id)
+    return {"detail": "Upload aborted"}
+
+
+async def _list_files(db: AsyncSession, scans, before_id: Optional[int], limit: int, filters) -> List[FileModel]:
+    # One keyset range scan per index, newest first, merged here; an OR
+    # across columns would defeat the indexes
+    files: Dict[int, FileModel] = {}
+    for criteria in scans:
+        query = select(FileModel).where(*criteria, *filters)
+        if before_id is not None:
+            query = query.where(FileModel.id < before_id)
+        for file in (await db.execute(query.order_by(FileModel.id.desc()).limit(limit))).scalars():
+            files[file.id] = file
+    return sorted(files.values(), key=lambda file: file.id, reverse=True)[:limit]
+
+def _file_filters(uploaded_after: Optional[datetime], uploaded_before: Optional[datetime],
+                  min_size: Optional[int], max_size: Optional[int]) -> list:
+    filters = []
+    # Stored timestamps are UTC (server default), so compare in UTC
+    if uploaded_after is not None:
+        filters.append(FileModel.uploaded_at >= _as_utc(uploaded_after))
+    if uploaded_before is not None:
+        filters.append(FileModel.uploaded_at < _as_utc(uploaded_before))
+    if min_size is not None:
+        filters.append(FileModel.size >= min_size)
+    if max_size is not None:
+        filters.append(FileModel.size <= max_size)
+    return filters
+
+def _as_utc(value: datetime) -> datetime:
+    return value.astimezone(timezone.utc) if value.tzinfo else value
+
+def _between(user_id: int, peer_id: int):
+    return [
+        (FileModel.uploaded_by == user_id, FileModel.received_by == peer_id),
+        (FileModel.uploaded_by == peer_id, FileModel.received_by == user_id),
+    ]
 
 @router.get("/files", response_model=List[FileOut])
-def get_user_files(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    files = db.query(FileModel).filter(
-        (FileModel.uploaded_by == current_user.id) |
-        (FileModel.received_by == current_user.id)
-    ).all()
-    return files
-
-# Add to your FastAPI backend
-@router.get("/files/{user_id}", response_model=List[FileOut])
 async def get_user_files(
+    peer_id: Optional[int] = Query(None),
+    before_id: Optional[int] = Query(None),
+    limit: int = Query(FILE_PAGE_SIZE, ge=1, le=MAX_FILE_PAGE_SIZE),
+    uploaded_after: Optional[datetime] = Query(None),
+    uploaded_before: Optional[datetime] = Query(None),
+    min_size: Optional[int] = Query(None, ge=0),
+    max_size: Optional[int] = Query(None, ge=0),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Newest first; pass the last id of a page as before_id for the next
+    if peer_id is not None:
+        scans = _between(current_user.id, peer_id)
+    else:
+        scans = [(FileModel.uploaded_by == current_user.id,), (FileModel.received_by == current_user.id,)]
+    filters = _file_filters(uploaded_after, uploaded_before, min_size, max_size)
+    return await _list_files(db, scans, before_id, limit, filters)
+
+@router.get("/files/{user_id}", response_model=List[FileOut])
+async def get_shared_files(
     user_id: int,
+    before_id: Optional[int] = Query(None),
+    limit: int = Query(FILE_PAGE_SIZE, ge=1, le=MAX_FILE_PAGE_SIZE),
+    uploaded_after: Optional[datetime] = Query(None),
+    uploaded_before: Optional[datetime] = Query(None),
+    min_size: Optional[int] = Query(None, ge=0),
+    max_size: Optional[int] = Query(None, ge=0),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    print("Current user ID:", current_user.id)
-    print("Requested user ID:", user_id)
-    files = db.query(FileModel).filter(
-        ((FileModel.uploaded_by == current_user.id) &
-        (FileModel.received_by == user_id)) |
-        ((FileModel.uploaded_by == user_id) &
-        (FileModel.received_by == current_user.id))
-    ).all()
-    return files
+    logger.debug("listing shared files", extra={"user_id": current_user.id, "peer_id": user_id})
+    filters = _file_filters(uploaded_after, uploaded_before, min_size, max_size)
+    return await _list_files(db, _between(current_user.id, user_id), before_id, limit, filters)
+
+@router.get("/usage", response_model=StorageUsageOut)
+async def get_storage_usage(current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    return await storage_used(db, current_user.id)
 
 
 @router.get("/download/{file_id}")
-def download_file(file_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    file = db.query(FileModel).filter(FileModel.id == file_id).first()
+async def download_file(
+    file_id: int,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    file = await file_metadata_cache.get(db, file_id)
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
     
-    if file.uploaded_by != current_user.id and file.received_by != current_user.id:
+    if not file.can_access(current_user.id):
         raise HTTPException(status_code=403, detail="Not authorized to access this file")
     
-    if not os.path.exists(file.path):
+    try:
+        stat_result = await run_in_threadpool(os.stat, file.path)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="File not found on server")
-    
-    return FileResponse(path=file.path, filename=file.filename)
+
+    headers = {"last-modified": last_modified(stat_result)}
+    etag = strong_etag(file)
+    if etag:
+        headers["etag"] = etag
+        headers["cache-control"] = f"private, max-age={DOWNLOAD_MAX_AGE}"
+    else:
+        headers["cache-control"] = "private, no-cache"
+    if is_not_modified(request.headers, etag, stat_result):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    # FileResponse serves Range/multi-range and If-Range itself, and hands
+    # the file to the server (ASGI pathsend) when the server supports it
+    return FileResponse(path=file.path, filename=file.filename, headers=headers, stat_result=stat_result)
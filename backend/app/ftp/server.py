@@ -1,66 +1,197 @@
-from pyftpdlib.authorizers import DummyAuthorizer
 from pyftpdlib.handlers import FTPHandler
-from pyftpdlib.servers import FTPServer
+from pyftpdlib.servers import FTPServer, MultiprocessFTPServer, ThreadedFTPServer
+from sqlalchemy import func
+import logging
 import os
+import queue
 import threading
-from sqlalchemy.orm import Session
-from ..models.user import User
+import time
 from ..models.file import File
+from ..models.user import User
+from ..models import message  # noqa: F401 - User's relationships need these mappers when run standalone
 from ..database import SessionLocal
+from . import FTP_EMBEDDED
+from .authorizer import DatabaseAuthorizer, register_authorizer
+from .storage import ROOT_DIR
+from .throttle import BandwidthLimitedDTPHandler, TokenBucket
+
+# threaded     - one thread per connection; logins query the database, so
+#                this keeps one slow login from stalling every transfer
+# async        - single IO loop (pyftpdlib FTPServer); logins block the loop
+# multiprocess - one process per connection; only when run standalone
+FTP_SERVER_CLASSES = {
+    "async": FTPServer,
+    "threaded": ThreadedFTPServer,
+    "multiprocess": MultiprocessFTPServer,
+}
+
+FTP_HOST = os.getenv("FTP_HOST", "0.0.0.0")
+FTP_PORT = int(os.getenv("FTP_PORT", "2121"))
+FTP_ROOT_DIR = os.getenv("FTP_ROOT_DIR", ROOT_DIR)
+FTP_SERVER_MODE = os.getenv("FTP_SERVER_MODE", "threaded")
+FTP_MAX_CONNECTIONS = int(os.getenv("FTP_MAX_CONNECTIONS", "512"))
+FTP_MAX_CONNECTIONS_PER_IP = int(os.getenv("FTP_MAX_CONNECTIONS_PER_IP", "0"))  # 0 = unlimited
+# Bandwidth limits in bytes/second, 0 = unlimited
+FTP_READ_LIMIT = int(os.getenv("FTP_READ_LIMIT", "0"))
+FTP_WRITE_LIMIT = int(os.getenv("FTP_WRITE_LIMIT", "0"))
+FTP_GLOBAL_READ_LIMIT = int(os.getenv("FTP_GLOBAL_READ_LIMIT", "0"))
+FTP_GLOBAL_WRITE_LIMIT = int(os.getenv("FTP_GLOBAL_WRITE_LIMIT", "0"))
+FTP_PASSIVE_PORTS = os.getenv("FTP_PASSIVE_PORTS")  # e.g. "60000-60100"
+FTP_MASQUERADE_ADDRESS = os.getenv("FTP_MASQUERADE_ADDRESS")
+FTP_RECORD_BATCH_SIZE = int(os.getenv("FTP_RECORD_BATCH_SIZE", "100"))
+FTP_RECORD_INTERVAL = float(os.getenv("FTP_RECORD_INTERVAL", "1.0"))  # seconds
+
+logger = logging.getLogger(__name__)
+
+
+class UploadRecorder:
+    # Batches files received over FTP into the files table from a
+    # background thread, so the FTP IO loop never waits on the database
+    def __init__(self, batch_size=FTP_RECORD_BATCH_SIZE, interval=FTP_RECORD_INTERVAL):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def record(self, username, path):
+        if self._pid != os.getpid():
+            # Forked connection process (multiprocess mode): the flusher
+            # thread didn't survive the fork and the process exits when the
+            # connection closes, so write straight away
+            record_file_uploads([(username, path)])
+            return
+        self._ensure_thread()
+        self._queue.put((username, path))
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="ftp-upload-recorder", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                record_file_uploads(batch)
+            except Exception:
+                logger.exception("failed to record FTP uploads", extra={"count": len(batch)})
+
+
+upload_recorder = UploadRecorder()
+
+
+class ChatPortalFTPHandler(FTPHandler):
+    dtp_handler = BandwidthLimitedDTPHandler
+
+    def on_file_received(self, file):
+        upload_recorder.record(self.username, file)
+
+
+def configure_handler(root_dir=FTP_ROOT_DIR):
+    # Users are checked against the database when they log in, so
+    # startup does no per-user work and new registrations work at once
+    authorizer = DatabaseAuthorizer(root_dir)
+    register_authorizer(authorizer)
+
+    # Add anonymous user (read-only)
+    authorizer.add_anonymous(root_dir, perm='elr')
+
+    # FTP handler settings
+    handler = ChatPortalFTPHandler
+    handler.authorizer = authorizer
+    if FTP_PASSIVE_PORTS:
+        start, end = (int(port) for port in FTP_PASSIVE_PORTS.split("-"))
+        handler.passive_ports = range(start, end + 1)
+    if FTP_MASQUERADE_ADDRESS:
+        handler.masquerade_address = FTP_MASQUERADE_ADDRESS
+
+    dtp_handler = BandwidthLimitedDTPHandler
+    dtp_handler.read_limit = FTP_READ_LIMIT
+    dtp_handler.write_limit = FTP_WRITE_LIMIT
+    dtp_handler.global_read_bucket = TokenBucket(FTP_GLOBAL_READ_LIMIT) if FTP_GLOBAL_READ_LIMIT else None
+    dtp_handler.global_write_bucket = TokenBucket(FTP_GLOBAL_WRITE_LIMIT) if FTP_GLOBAL_WRITE_LIMIT else None
+    return handler
+
+
+def create_ftp_server(host=FTP_HOST, port=FTP_PORT, root_dir=FTP_ROOT_DIR, mode=FTP_SERVER_MODE):
+    if mode not in FTP_SERVER_CLASSES:
+        raise ValueError(f"FTP_SERVER_MODE must be one of {tuple(FTP_SERVER_CLASSES)}")
+    os.makedirs(root_dir, exist_ok=True)
+    handler = configure_handler(root_dir)
+    server = FTP_SERVER_CLASSES[mode]((host, port), handler)
+    server.max_cons = FTP_MAX_CONNECTIONS
+    server.max_cons_per_ip = FTP_MAX_CONNECTIONS_PER_IP
+    return server
 
 
 class FTPServerThread(threading.Thread):
-    def __init__(self, host='0.0.0.0', port=2121, root_dir='./ftp_data'):
+    def __init__(self, host=FTP_HOST, port=FTP_PORT, root_dir=FTP_ROOT_DIR, mode=FTP_SERVER_MODE):
         super().__init__()
         self.daemon = True
         self.host = host
         self.port = port
         self.root_dir = root_dir
-        
+        if mode == "multiprocess":
+            # Forking from a thread of the multi-threaded API process is unsafe
+            logger.warning("FTP_SERVER_MODE=multiprocess needs a standalone FTP process; using threaded")
+            mode = "threaded"
+        self.mode = mode
+
         # Ensure root directory exists
         os.makedirs(self.root_dir, exist_ok=True)
-    
+
     def run(self):
-        # Create authorizer
-        authorizer = DummyAuthorizer()
-        
-        # Add anonymous user (read-only)
-        authorizer.add_anonymous(self.root_dir, perm='elr')
-        
-        # Add users from database
-        db = SessionLocal()
-        users = db.query(User).all()
-        for user in users:
-            print(f"Adding user: {user.username}")
-            user_dir = os.path.join(self.root_dir, user.username)
-            os.makedirs(user_dir, exist_ok=True)
-            # Add user with read/write permissions
-            authorizer.add_user(user.username, user.hashed_password, user_dir, perm='elradfmwM')
-        db.close()
-        
-        # FTP handler settings
-        handler = FTPHandler
-        handler.authorizer = authorizer
-        
-        # Create server
-        server = FTPServer((self.host, self.port), handler)
+        server = create_ftp_server(self.host, self.port, self.root_dir, self.mode)
         server.serve_forever()
 
 def start_ftp_server():
-    # Get FTP server configuration from environment if needed
+    if not FTP_EMBEDDED:
+        return None
     ftp_thread = FTPServerThread()
     ftp_thread.start()
     return ftp_thread
 
-# Record file upload in database
-def record_file_upload(filename, path, size, user_id):
+# Record file uploads in database
+def record_file_uploads(uploads):
     db = SessionLocal()
-    file = File(
-        filename=filename,
-        path=path,
-        size=size,
-        uploaded_by=user_id
-    )
-    db.add(file)
-    db.commit()
-    db.close()
\ No newline at end of file
+    try:
+        usernames = {username for username, _ in uploads}
+        user_ids = dict(db.query(User.username, User.id).filter(User.username.in_(usernames)).all())
+        # A STOR to an existing name replaces the file; update its row
+        # rather than listing (and counting) the path twice
+        paths = {path for _, path in uploads}
+        existing = {file.path: file for file in db.query(File).filter(File.path.in_(paths)).order_by(File.id)}
+        for username, path in uploads:
+            if username not in user_ids or not os.path.exists(path):
+                continue  # anonymous users are read-only; file may be gone
+            file = existing.get(path)
+            if file is None:
+                file = existing[path] = File(filename=os.path.basename(path), path=path)
+                db.add(file)
+            else:
+                file.content_hash = None
+                file.uploaded_at = func.now()
+            file.size = os.path.getsize(path)
+            file.uploaded_by = user_ids[username]
+        db.commit()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    # Standalone FTP process, separate from the API workers
+    from ..monitoring.logs import configure_logging
+    configure_logging()
+    create_ftp_server().serve_forever()
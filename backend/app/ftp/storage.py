@@ -0,0 +1,65 @@
+import hashlib
+import os
+import tempfile
+from typing import BinaryIO, NamedTuple
+
+ROOT_DIR = "./ftp_data"
+BLOB_DIR = os.path.join(ROOT_DIR, ".blobs")
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class StoredBlob(NamedTuple):
+    digest: str
+    size: int
+    path: str
+    created: bool
+
+
+class BlobStore:
+    # Content-addressed storage: every distinct file body is kept exactly
+    # once under its sha256, however many File rows point at it
+    def __init__(self, root: str = BLOB_DIR, chunk_size: int = UPLOAD_CHUNK_SIZE):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.tmp_dir = os.path.join(root, "tmp")
+
+    def path_for(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.path_for(digest))
+
+    def store(self, source: BinaryIO) -> StoredBlob:
+        # Blocking: run on a worker thread. Hashes while copying so the
+        # body is only read once.
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as buffer:
+                while True:
+                    chunk = source.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    buffer.write(chunk)
+                    size += len(chunk)
+            return self.commit(tmp_path, digest.hexdigest(), size)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def commit(self, tmp_path: str, digest: str, size: int) -> StoredBlob:
+        path = self.path_for(digest)
+        if os.path.exists(path):
+            # Identical content is already stored; drop the new copy
+            os.remove(tmp_path)
+            return StoredBlob(digest, size, path, False)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        return StoredBlob(digest, size, path, True)
+
+
+blob_store = BlobStore()
@@ -0,0 +1,91 @@
+import threading
+from timeit import default_timer as timer
+from typing import Optional
+
+from pyftpdlib.handlers import DTPHandler
+
+
+class TokenBucket:
+    # Shared between all data channels of a server process; the lock makes
+    # it safe for the threaded server mode
+    def __init__(self, rate: int):
+        self.rate = rate
+        self.tokens = float(rate)
+        self.updated = timer()
+        self._lock = threading.Lock()
+
+    def consume(self, amount: int) -> float:
+        """Take ``amount`` bytes and return how long to pause to stay under the rate."""
+        with self._lock:
+            now = timer()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class BandwidthLimitedDTPHandler(DTPHandler):
+    """Data channel with per-connection and server-wide bandwidth limits.
+
+    ``read_limit`` / ``write_limit`` cap each transfer in bytes per second;
+    ``global_read_bucket`` / ``global_write_bucket`` are shared by every
+    transfer in the process. 0 / None means unlimited.
+    """
+
+    read_limit = 0
+    write_limit = 0
+    global_read_bucket: Optional[TokenBucket] = None
+    global_write_bucket: Optional[TokenBucket] = None
+
+    def __init__(self, sock, cmd_channel):
+        super().__init__(sock, cmd_channel)
+        self._throttler = None
+        self._read_bucket = TokenBucket(self.read_limit) if self.read_limit else None
+        self._write_bucket = TokenBucket(self.write_limit) if self.write_limit else None
+        # Smaller buffers give smoother throughput under a low limit
+        read_cap = min(filter(None, (self.read_limit, getattr(self.global_read_bucket, "rate", 0))), default=0)
+        write_cap = min(filter(None, (self.write_limit, getattr(self.global_write_bucket, "rate", 0))), default=0)
+        while read_cap and self.ac_in_buffer_size > read_cap:
+            self.ac_in_buffer_size //= 2
+        while write_cap and self.ac_out_buffer_size > write_cap:
+            self.ac_out_buffer_size //= 2
+
+    def _limited(self) -> bool:
+        return any((self._read_bucket, self._write_bucket, self.global_read_bucket, self.global_write_bucket))
+
+    def use_sendfile(self):
+        # sendfile() bypasses send(), so it can't be throttled
+        return not self._limited() and super().use_sendfile()
+
+    def recv(self, buffer_size):
+        chunk = super().recv(buffer_size)
+        self._throttle(len(chunk), self._read_bucket, self.global_read_bucket)
+        return chunk
+
+    def send(self, data):
+        num_sent = super().send(data)
+        self._throttle(num_sent, self._write_bucket, self.global_write_bucket)
+        return num_sent
+
+    def _throttle(self, amount, *buckets):
+        delay = max((bucket.consume(amount) for bucket in buckets if bucket is not None), default=0.0)
+        if delay <= 0:
+            return
+
+        def unsleep():
+            event = self.ioloop.READ if self.receive else self.ioloop.WRITE
+            self.add_channel(events=event)
+
+        self.del_channel()
+        self._cancel_throttler()
+        self._throttler = self.ioloop.call_later(delay, unsleep, _errback=self.handle_error)
+
+    def _cancel_throttler(self):
+        if self._throttler is not None and not self._throttler.cancelled:
+            self._throttler.cancel()
+
+    def close(self):
+        self._cancel_throttler()
+        super().close()
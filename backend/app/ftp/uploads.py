@@ -0,0 +1,124 @@
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from typing import Optional
+
+from .storage import ROOT_DIR, StoredBlob, blob_store
+
+UPLOAD_SESSION_DIR = os.path.join(ROOT_DIR, ".uploads")
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24")) * 3600
+
+_SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadSessionError(Exception):
+    pass
+
+
+class UploadSessionStore:
+    # Each session is a directory holding meta.json and the bytes received so
+    # far (data.part). The part file's length is the resume offset, so
+    # progress survives a server restart.
+    def __init__(self, root: str = UPLOAD_SESSION_DIR, ttl: int = UPLOAD_SESSION_TTL):
+        self.root = root
+        self.ttl = ttl
+
+    def _dir(self, upload_id: str) -> str:
+        if not _SESSION_ID.match(upload_id):
+            raise KeyError(upload_id)
+        return os.path.join(self.root, upload_id)
+
+    def _part_path(self, upload_id: str) -> str:
+        return os.path.join(self._dir(upload_id), "data.part")
+
+    def create(self, user_id: int, recipient_id: int, filename: str, size: Optional[int]) -> dict:
+        self.purge_expired()
+        upload_id = uuid.uuid4().hex
+        session_dir = self._dir(upload_id)
+        os.makedirs(session_dir)
+        meta = {
+            "upload_id": upload_id,
+            "user_id": user_id,
+            "recipient_id": recipient_id,
+            "filename": filename,
+            "size": size,
+            "created_at": time.time(),
+        }
+        with open(os.path.join(session_dir, "meta.json"), "w") as meta_file:
+            json.dump(meta, meta_file)
+        open(self._part_path(upload_id), "wb").close()
+        meta["offset"] = 0
+        return meta
+
+    def get(self, upload_id: str) -> dict:
+        try:
+            with open(os.path.join(self._dir(upload_id), "meta.json")) as meta_file:
+                meta = json.load(meta_file)
+            meta["offset"] = os.path.getsize(self._part_path(upload_id))
+        except (OSError, ValueError):
+            raise KeyError(upload_id)
+        return meta
+
+    def _open_locked(self, upload_id: str, mode: str):
+        # The lock lives on the part file itself, so it holds across worker
+        # processes and is released whenever the file is closed
+        try:
+            part = open(self._part_path(upload_id), mode)
+        except FileNotFoundError:
+            raise KeyError(upload_id)
+        try:
+            fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            part.close()
+            raise UploadSessionError("Another request is writing to this upload")
+        return part
+
+    def open_at(self, upload_id: str, offset: int):
+        # Writing from an offset at or below what we have lets clients
+        # retransmit a chunk whose acknowledgement was lost
+        part = self._open_locked(upload_id, "r+b")
+        current = os.fstat(part.fileno()).st_size
+        if offset > current:
+            part.close()
+            raise UploadSessionError(f"Offset {offset} is past the received length {current}")
+        part.truncate(offset)
+        part.seek(offset)
+        return part
+
+    def finalize(self, upload_id: str) -> StoredBlob:
+        meta = self.get(upload_id)
+        part_path = self._part_path(upload_id)
+        with self._open_locked(upload_id, "rb") as part:
+            received = os.fstat(part.fileno()).st_size
+            if meta["size"] is not None and received != meta["size"]:
+                raise UploadSessionError(f"Upload incomplete: {received} of {meta['size']} bytes received")
+            digest = hashlib.sha256()
+            for chunk in iter(lambda: part.read(blob_store.chunk_size), b""):
+                digest.update(chunk)
+            # Move the part file into the blob store rather than copying it
+            stored = blob_store.commit(part_path, digest.hexdigest(), received)
+        self.delete(upload_id)
+        return stored
+
+    def delete(self, upload_id: str):
+        shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+
+    def purge_expired(self):
+        if not os.path.isdir(self.root):
+            return
+        cutoff = time.time() - self.ttl
+        for upload_id in os.listdir(self.root):
+            session_dir = os.path.join(self.root, upload_id)
+            try:
+                if os.path.getmtime(os.path.join(session_dir, "data.part")) < cutoff:
+                    shutil.rmtree(session_dir, ignore_errors=True)
+            except OSError:
+                continue
+
+
+upload_sessions = UploadSessionStore()
@@ -1,18 +1,64 @@
+# First, so the startup report's clock includes every import below
+from .monitoring.startup import startup_report
+
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-import uvicorn
 
-from .database import Base, engine
+from .database import engine, async_engine
 
 from .auth.router import router as auth_router
 from .chat.router import router as chat_router
+from .ftp import FTP_EMBEDDED
 from .ftp.router import router as ftp_router
-from .ftp.server import start_ftp_server
+from .chat.persistence import message_writer
+from .chat.delivery import manager as connection_manager
+from .chat.presence import presence
+from .chat.archive import archiver
+from .chat.transport import WS_PER_MESSAGE_DEFLATE
+from .auth.hashing import password_hasher
+from .migrations import prepare_schema
+from .monitoring.logs import configure_logging
+from .monitoring.metrics import instrument_engine
+from .monitoring.middleware import MetricsMiddleware
+from .monitoring.router import router as monitoring_router
+
+configure_logging()
+instrument_engine(engine, "sync")
+instrument_engine(async_engine.sync_engine, "async")
+startup_report.mark("imports")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema work is one version query (none with DB_SCHEMA_MODE=skip);
+    # run python -m app.migrations before deploying
+    with startup_report.phase("schema"):
+        prepare_schema(engine)
+    if FTP_EMBEDDED:
+        # Only imported when it runs here, so API-only workers skip pyftpdlib
+        with startup_report.phase("ftp"):
+            from .ftp.server import start_ftp_server
+            start_ftp_server()
+    # Fails startup on a bad CHAT_BROKER_URL instead of on each WebSocket
+    with startup_report.phase("broker"):
+        await connection_manager.start()
+    with startup_report.phase("background_tasks"):
+        archiver.start()
+    startup_report.finish()
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
+    yield
 
-app = FastAPI(title="Chat Portal with FTP")
+    startup_report.stopping()
+    # Flush any messages still waiting in the write-behind queue
+    await message_writer.stop()
+    await archiver.stop()
+    await presence.stop()
+    await connection_manager.stop()
+    password_hasher.shutdown()
+    await async_engine.dispose()
+
+app = FastAPI(title="Chat Portal with FTP", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -22,20 +68,22 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 # Include routers
 app.include_router(auth_router, prefix="/api/auth")
 app.include_router(chat_router, prefix="/api/chat")
 app.include_router(ftp_router, prefix="/api/ftp")
-
-@app.on_event("startup")
-def startup_event():
-    # Start FTP server in a separate thread
-    start_ftp_server()
+app.include_router(monitoring_router)
 
 @app.get("/")
 def read_root():
     return {"message": "Welcome to Chat Portal with FTP"}
 
 if __name__ == "__main__":
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    import sys
+    import uvicorn
+
+    # Reloading re-runs the whole startup on every change; opt in with --reload
+    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload="--reload" in sys.argv[1:],
+                ws_per_message_deflate=WS_PER_MESSAGE_DEFLATE)
@@ -0,0 +1,145 @@
+import logging
+import os
+from typing import Callable, List, Tuple
+
+from contextlib import contextmanager
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, insert, select
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+from .database import Base, add_missing_columns, engine
+from .models import conversation, file, message, user  # noqa: F401 - every table on Base.metadata
+from .chat.search import assume_search_index, install_search_index
+
+# check   - refuse to start unless migrations were applied beforehand
+# migrate - apply pending migrations at startup (development)
+# skip    - assume the schema is current; no schema queries at all
+DB_SCHEMA_MODE = os.getenv("DB_SCHEMA_MODE", "check")
+
+# Named explicitly: run as python -m app.migrations, __name__ is "__main__"
+logger = logging.getLogger("app.migrations")
+
+# pg_advisory_lock key held while migrations run
+_MIGRATION_LOCK_KEY = 0x6d696772
+
+# Kept off Base.metadata: it describes the schema rather than being part of it
+_metadata = MetaData()
+schema_version = Table(
+    "schema_version", _metadata,
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("description", String),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+
+class SchemaOutOfDate(RuntimeError):
+    pass
+
+
+def _baseline(bind):
+    # Everything up to the introduction of versioning. Idempotent, so
+    # databases created by earlier releases are brought up to date too.
+    Base.metadata.create_all(bind=bind)
+    add_missing_columns(bind)
+    # create_all skips indexes on tables that already exist
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+    install_search_index(bind)
+
+
+def _index_file_paths(bind):
+    for index in file.File.__table__.indexes:
+        if index.name == "ix_files_path":
+            index.create(bind=bind, checkfirst=True)
+
+
+def _search_archive(bind):
+    # Indexes messages_archive alongside messages, backfilling what is
+    # already archived
+    install_search_index(bind)
+
+
+# Append new steps with the next version number; never edit applied ones
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, "baseline schema", _baseline),
+    (2, "index files by path", _index_file_paths),
+    (3, "full-text index on archived messages", _search_archive),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(bind=engine) -> int:
+    try:
+        with bind.connect() as connection:
+            return connection.execute(select(func.max(schema_version.c.version))).scalar() or 0
+    except (OperationalError, ProgrammingError):
+        # No schema_version table yet
+        return 0
+
+
+@contextmanager
+def _migration_lock(bind):
+    # Workers started together with DB_SCHEMA_MODE=migrate take turns; each
+    # re-reads the version once it holds the lock. SQLite serialises the
+    # DDL itself, and a step that loses the race is idempotent.
+    if bind.dialect.name != "postgresql":
+        yield
+        return
+    with bind.connect() as connection:
+        connection.execute(select(func.pg_advisory_lock(_MIGRATION_LOCK_KEY)))
+        try:
+            yield
+        finally:
+            connection.execute(select(func.pg_advisory_unlock(_MIGRATION_LOCK_KEY)))
+
+
+def migrate(bind=engine) -> List[int]:
+    """Apply pending migrations in order; returns the versions applied."""
+    applied = []
+    if current_version(bind) >= SCHEMA_VERSION:
+        return applied
+    with _migration_lock(bind):
+        version = current_version(bind)
+        schema_version.create(bind=bind, checkfirst=True)
+        for target, description, step in MIGRATIONS:
+            if target <= version:
+                continue
+            logger.info("applying migration", extra={"version": target, "description": description})
+            step(bind)
+            with bind.begin() as connection:
+                connection.execute(insert(schema_version).values(version=target, description=description))
+            applied.append(target)
+    return applied
+
+
+def check(bind=engine):
+    version = current_version(bind)
+    if version < SCHEMA_VERSION:
+        raise SchemaOutOfDate(
+            f"Database schema is at version {version}, this release needs {SCHEMA_VERSION}; "
+            "run python -m app.migrations"
+        )
+
+
+def prepare_schema(bind=engine, mode: str = DB_SCHEMA_MODE):
+    if mode == "skip":
+        # Trusted to be current, search index included
+        assume_search_index(bind)
+        return
+    if mode == "migrate":
+        migrate(bind)
+    elif mode == "check":
+        check(bind)
+    else:
+        raise ValueError("DB_SCHEMA_MODE must be one of ('check', 'migrate', 'skip')")
+    # Search needs to know what exists, whoever created it
+    install_search_index(bind, create=False)
+
+
+if __name__ == "__main__":
+    from .monitoring.logs import configure_logging
+
+    configure_logging()
+    applied = migrate()
+    logger.info("schema is current", extra={"version": SCHEMA_VERSION, "applied": applied})
@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index, UniqueConstraint
+from ..database import Base
+
+# One row per participant per conversation, updated as messages are written
+class Conversation(Base):
+    __tablename__ = "conversations"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    conversation_key = Column(String, nullable=False)  # "user:<peer_id>" or "group:<group_id>"
+    peer_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    group_id = Column(Integer, ForeignKey("groups.id"), nullable=True)
+    last_message_id = Column(Integer, nullable=True)
+    last_message_preview = Column(String, nullable=True)
+    last_sender_id = Column(Integer, nullable=True)
+    last_message_at = Column(DateTime(timezone=True), nullable=True)
+    last_read_message_id = Column(Integer, default=0, nullable=False)
+    unread_count = Column(Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "conversation_key", name="uq_conversations_user_key"),
+        # Inbox: a user's conversations, most recent first
+        Index("ix_conversations_user_last_message", "user_id", "last_message_id"),
+    )
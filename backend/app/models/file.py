@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import BigInteger, Column, Integer, String, ForeignKey, DateTime, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from ..database import Base
@@ -10,6 +10,7 @@ class File(Base):
     filename = Column(String)
     path = Column(String)
     size = Column(Integer)
+    content_hash = Column(String(64), nullable=True, index=True)  # sha256 of the stored blob
     uploaded_by = Column(Integer, ForeignKey("users.id"))
     received_by = Column(Integer, ForeignKey("users.id"), nullable=True)  # New field
     uploaded_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -17,3 +18,22 @@ class File(Base):
     # Relationships
     sender = relationship("User", foreign_keys=[uploaded_by], back_populates="sent_files")
     recipient = relationship("User", foreign_keys=[received_by], back_populates="received_files")
+
+    # Keyset listings walk these by id: a user's sent or received files,
+    # and the files between two users in either direction
+    __table_args__ = (
+        Index("ix_files_uploaded_by_id", "uploaded_by", "id"),
+        Index("ix_files_received_by_id", "received_by", "id"),
+        Index("ix_files_uploaded_by_received_by_id", "uploaded_by", "received_by", "id"),
+        # FTP uploads look up the row of an overwritten path
+        Index("ix_files_path", "path"),
+    )
+
+# Running totals of each user's uploads, maintained by app.ftp.quota as
+# files are recorded so quota checks never sum the files table
+class StorageUsage(Base):
+    __tablename__ = "storage_usage"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True, autoincrement=False)
+    bytes_used = Column(BigInteger, default=0, nullable=False)
+    file_count = Column(Integer, default=0, nullable=False)
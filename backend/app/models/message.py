@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from ..database import Base
@@ -18,6 +18,29 @@ class Message(Base):
     receiver = relationship("User", foreign_keys=[receiver_id], back_populates="received_messages")
     group = relationship("Group", back_populates="messages")
 
+    # Keyset pagination walks these by id within one conversation
+    __table_args__ = (
+        Index("ix_messages_sender_receiver_id", "sender_id", "receiver_id", "id"),
+        Index("ix_messages_group_id_id", "group_id", "id"),
+    )
+
+class ArchivedMessage(Base):
+    # Messages past the retention window, moved here by app.chat.archive;
+    # same columns and ids, so every id in here is below every id in messages
+    __tablename__ = "messages_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    content = Column(Text)
+    sender_id = Column(Integer, ForeignKey("users.id"))
+    receiver_id = Column(Integer, ForeignKey("users.id"))
+    group_id = Column(Integer, ForeignKey("groups.id"), nullable=True)
+    created_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        Index("ix_messages_archive_sender_receiver_id", "sender_id", "receiver_id", "id"),
+        Index("ix_messages_archive_group_id_id", "group_id", "id"),
+    )
+
 class Group(Base):
     __tablename__ = "groups"
     
@@ -41,4 +64,8 @@ class GroupMember(Base):
     
     # Fix relationship references
     group = relationship("Group", back_populates="members")
-    user = relationship("User", back_populates="groups")
\ No newline at end of file
+    user = relationship("User", back_populates="groups")
+
+    __table_args__ = (
+        Index("ix_group_members_group_user", "group_id", "user_id"),
+    )
@@ -0,0 +1,278 @@
+import bisect
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+
+# Prometheus text exposition, kept dependency-free like the broker client.
+# Every instrument is process-local: with several workers, scrape each one.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Bytes per second, 64 KiB/s up to 1 GiB/s
+THROUGHPUT_BUCKETS = tuple(float(64 * 1024 * 4 ** step) for step in range(8))
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self.labels()
+        registry.register(self)
+
+    def labels(self, *values):
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _default(self):
+        # Unlabelled metrics act as their own single child
+        return self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += self.samples()
+        return "\n".join(lines)
+
+
+class _Value:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+    def samples(self):
+        return [f"{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+                for key, child in list(self._children.items())]
+
+
+class Gauge(Metric):
+    """A settable gauge, or one computed at scrape time from ``set_function``.
+
+    Callback gauges cost nothing on the hot path: the owning module points
+    them at state it already keeps (queue lengths, connection maps).
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function: Optional[Callable[[], object]] = None
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self._default().set(value)
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._default().dec(amount)
+
+    def set_function(self, function: Callable[[], object]):
+        # Returns a number, or a {label values tuple: number} mapping for labelled gauges
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            try:
+                value = self._function()
+            except Exception:
+                return []
+            items = value.items() if isinstance(value, dict) else [((), value)]
+            return [f"{self.name}{_format_labels(self.labelnames, tuple(map(str, key)))} {_format_value(number)}"
+                    for key, number in items]
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+                for key, child in list(self._children.items())]
+
+
+class _HistogramValue:
+    __slots__ = ("upper_bounds", "counts", "sum", "_lock")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.upper_bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_start")
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.upper_bounds)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def samples(self):
+        lines = []
+        for key, child in list(self._children.items()):
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.upper_bounds + (math.inf,), counts):
+                cumulative += count
+                bucket = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, bucket)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template",
+    ("method", "route", "status"))
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served")
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "Time spent executing SQL statements",
+    ("engine", "operation"))
+WS_CONNECTIONS = Gauge("ws_connections", "WebSocket connections open on this process")
+WS_SEND_QUEUE_DEPTH = Gauge("ws_send_queue_depth", "Frames waiting in WebSocket send queues")
+WS_FANOUT_SECONDS = Histogram(
+    "ws_fanout_duration_seconds", "Time to queue one message for every local recipient",
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+WS_FRAMES_DROPPED = Counter("ws_frames_dropped", "Frames dropped for slow WebSocket consumers")
+MESSAGE_WRITER_QUEUE_DEPTH = Gauge("message_writer_queue_depth", "Messages waiting for the batched writer")
+MESSAGES_ARCHIVED = Counter("messages_archived", "Messages moved from the hot table to the archive")
+PASSWORD_HASH_SECONDS = Histogram(
+    "password_hash_duration_seconds", "bcrypt hash/verify time on the hasher pool",
+    ("operation",), buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.5))
+PASSWORD_HASH_PENDING = Gauge("password_hash_pending", "bcrypt operations queued or running")
+PASSWORD_HASH_REJECTED = Counter("password_hash_rejected", "Logins/registrations refused by the hasher pool")
+FILE_TRANSFER_BYTES = Counter("file_transfer_bytes", "Bytes moved by upload and download routes", ("direction",))
+FILE_TRANSFER_THROUGHPUT = Histogram(
+    "file_transfer_throughput_bytes_per_second", "Per-request upload/download throughput",
+    ("direction",), buckets=THROUGHPUT_BUCKETS)
+DB_POOL_CHECKED_OUT = Gauge("db_pool_connections_in_use", "Connections checked out of the pool", ("engine",))
+
+
+def instrument_engine(engine, name: str):
+    """Time every statement on ``engine`` (pass ``async_engine.sync_engine`` for async)."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        DB_QUERY_SECONDS.labels(name, operation).observe(time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(context):
+        # after_cursor_execute doesn't run for failed statements
+        if context.connection is not None and context.connection.info.get("query_started"):
+            context.connection.info["query_started"].pop()
+
+    if hasattr(engine.pool, "checkedout"):
+        _pools[name] = engine.pool
+
+
+_pools: Dict[str, object] = {}
+DB_POOL_CHECKED_OUT.set_function(lambda: {(name,): pool.checkedout() for name, pool in _pools.items()})
@@ -0,0 +1,122 @@
+import cProfile
+import hmac
+import logging
+import os
+import time
+import uuid
+
+from .metrics import FILE_TRANSFER_BYTES, FILE_TRANSFER_THROUGHPUT, HTTP_IN_FLIGHT, HTTP_REQUEST_SECONDS
+
+# Routes whose request/response bodies are file contents, for throughput
+UPLOAD_ROUTES = {"/api/ftp/upload", "/api/ftp/uploads/{upload_id}"}
+DOWNLOAD_ROUTES = {"/api/ftp/download/{file_id}"}
+
+# Per-request profiling is off unless a token is configured; a request
+# sending "X-Profile: <token>" is run under cProfile and the stats are
+# written to PROFILE_DIR (open with python -m pstats or snakeviz)
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+
+logger = logging.getLogger(__name__)
+
+
+def _route_template(scope) -> str:
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if not path:
+        return "unmatched"
+    # Routes of included routers may only know their own part of the path;
+    # recover the prefix from the concrete request path
+    try:
+        rendered = path.format(**scope.get("path_params", {}))
+    except (KeyError, IndexError, ValueError):
+        return path
+    if rendered != scope["path"] and scope["path"].endswith(rendered):
+        return scope["path"][:-len(rendered)] + path
+    return path
+
+
+class MetricsMiddleware:
+    """Records latency per route template, plus file transfer throughput.
+
+    Pure ASGI so streaming bodies pass straight through; the byte counts
+    come from the messages as they go by.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._profiling = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        state = {"status": 500, "received": 0, "sent": 0}
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["received"] += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                headers = list(message.get("headers", []))
+                if "profile_file" in state:
+                    headers.append((b"x-profile-file", state["profile_file"].encode()))
+                    message = {**message, "headers": headers}
+                state["content_length"] = next(
+                    (int(value) for name, value in headers if name.lower() == b"content-length"), 0
+                )
+            elif message["type"] == "http.response.body":
+                state["sent"] += len(message.get("body", b""))
+            elif message["type"] == "http.response.pathsend":
+                # The server streams the file itself
+                state["sent"] += state["content_length"]
+            await send(message)
+
+        profiler = self._profiler_for(scope, state)
+        HTTP_IN_FLIGHT.inc()
+        try:
+            if profiler is not None:
+                profiler.enable()
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+                profiler.dump_stats(state["profile_path"])
+            HTTP_IN_FLIGHT.dec()
+            elapsed = time.perf_counter() - start
+            template = _route_template(scope)
+            HTTP_REQUEST_SECONDS.labels(scope["method"], template, state["status"]).observe(elapsed)
+            if template in UPLOAD_ROUTES and scope["method"] in ("POST", "PUT"):
+                self._record_transfer("upload", state["received"], elapsed)
+            elif template in DOWNLOAD_ROUTES:
+                self._record_transfer("download", state["sent"], elapsed)
+
+    @staticmethod
+    def _record_transfer(direction: str, size: int, elapsed: float):
+        if not size:
+            return
+        FILE_TRANSFER_BYTES.labels(direction).inc(size)
+        FILE_TRANSFER_THROUGHPUT.labels(direction).observe(size / max(elapsed, 1e-6))
+
+    def _profiler_for(self, scope, state):
+        if not PROFILE_TOKEN or self._profiling:
+            # Only one profiler can run on a thread at a time
+            return None
+        token = dict(scope.get("headers", [])).get(b"x-profile")
+        if token is None or not hmac.compare_digest(token, PROFILE_TOKEN.encode()):
+            return None
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        # cProfile sees the whole event loop thread, so other requests served
+        # concurrently show up too; profile on a quiet instance
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.prof"
+        state["profile_file"] = name
+        state["profile_path"] = os.path.join(PROFILE_DIR, name)
+        logger.info("profiling request", extra={"path": scope["path"], "profile": name})
+        self._profiling = True
+        return cProfile.Profile()
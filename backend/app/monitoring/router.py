@@ -0,0 +1,43 @@
+import asyncio
+
+from fastapi import APIRouter, status
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sqlalchemy import text
+
+from ..chat.delivery import manager as connection_manager
+from ..database import async_engine
+from .metrics import registry
+from .startup import startup_report
+
+router = APIRouter(tags=["Monitoring"])
+
+# Readiness fails rather than hangs when the database stops answering
+READINESS_DB_TIMEOUT = 2.0
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # Rendered on the event loop so callback gauges read consistent state
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@router.get("/healthz")
+async def liveness():
+    # The process is up and its event loop is serving; no dependencies checked
+    return {"status": "ok"}
+
+@router.get("/readyz")
+async def readiness():
+    # Ready once startup has finished and until shutdown begins, while the
+    # database answers and the chat broker is subscribed
+    body = {"status": startup_report.state, "startup": startup_report.as_dict()}
+    if not startup_report.ready:
+        return JSONResponse(body, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    if not connection_manager.healthy:
+        body.update(status="unavailable", error="chat broker is not connected")
+        return JSONResponse(body, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    try:
+        async with async_engine.connect() as connection:
+            await asyncio.wait_for(connection.execute(text("SELECT 1")), READINESS_DB_TIMEOUT)
+    except Exception as exc:
+        body.update(status="unavailable", error=repr(exc))
+        return JSONResponse(body, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return body
@@ -0,0 +1,55 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+
+class StartupReport:
+    """Where boot time goes, phase by phase, and whether we are ready.
+
+    Created when app.main starts importing, so the first phase covers the
+    module imports; later phases are timed around each lifespan step.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.phases: Dict[str, float] = {}
+        self.state = "starting"  # starting -> ready -> stopping
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def mark(self, name: str):
+        # Time since the previous phase ended
+        now = time.perf_counter()
+        self.phases[name] = now - self._last
+        self._last = now
+
+    @contextmanager
+    def phase(self, name: str):
+        self._last = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.mark(name)
+
+    def finish(self):
+        self.state = "ready"
+        logger.info("startup complete", extra=self.as_dict())
+
+    def stopping(self):
+        # Readiness fails from here on so load balancers drain us first
+        self.state = "stopping"
+
+    def as_dict(self) -> dict:
+        return {
+            "startup_ms": round((self._last - self.started) * 1000, 1),
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()},
+        }
+
+
+startup_report = StartupReport()
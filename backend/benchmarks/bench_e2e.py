@@ -0,0 +1,415 @@
+"""End-to-end load test for chat, auth and files.
+
+Starts the API with uvicorn in a subprocess, against a throwaway SQLite
+database unless DATABASE_URL points somewhere else (e.g. a local Postgres).
+It then drives these scenarios one after another over real sockets:
+
+    ws       N WebSocket users sending DMs and group messages
+             (send->ack and send->delivery latency)
+    login    burst of concurrent /api/auth/token logins
+    history  DM and group history, inbox and delta-sync reads
+    files    upload/download mix on /api/ftp
+
+Each scenario reports p50/p95/p99 latency, throughput and the server's
+peak RSS. Save a run as a baseline and compare later runs against it.
+Regressions beyond the tolerance are flagged, and the exit status is 1.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_e2e --save-baseline benchmarks/baselines/local.json
+    python -m benchmarks.bench_e2e --compare benchmarks/baselines/local.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+_workdir = tempfile.mkdtemp(prefix="bench-e2e-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_workdir, 'bench.db')}")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+
+import httpx  # noqa: E402
+import websockets  # noqa: E402
+
+from .stats import compare, load_baseline, save_baseline, summarize  # noqa: E402
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = "benchmark-password"
+SCENARIOS = ("ws", "login", "history", "files")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_mb(pid: int) -> float:
+    # Linux only; other platforms report 0
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+class Server:
+    def __init__(self, port: int, workers: int):
+        self.port = port
+        self.workers = workers
+        self.process = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self):
+        env = {**os.environ, "PYTHONPATH": BACKEND_DIR, "FTP_EMBEDDED": "0", "LOG_LEVEL": "WARNING",
+               "DB_SCHEMA_MODE": "check"}
+        # Migrate once up front, as a deployment would, rather than in every worker
+        subprocess.run([sys.executable, "-m", "app.migrations"], cwd=_workdir, env=env, check=True)
+        # Run in the scratch directory so ftp_data lands there too
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+             "--port", str(self.port), "--workers", str(self.workers), "--log-level", "warning"],
+            cwd=_workdir, env=env,
+        )
+        async with httpx.AsyncClient(base_url=self.url) as client:
+            for _ in range(300):
+                try:
+                    if (await client.get("/readyz")).status_code == 200:
+                        return
+                except httpx.TransportError:
+                    pass
+                if self.process.poll() is not None:
+                    raise RuntimeError("server exited during startup")
+                await asyncio.sleep(0.1)
+        raise RuntimeError("server did not start")
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(timeout=30)
+
+    def rss_mb(self) -> float:
+        # Parent plus uvicorn worker processes
+        pids = [self.process.pid]
+        try:
+            with open(f"/proc/{self.process.pid}/task/{self.process.pid}/children") as f:
+                pids += [int(pid) for pid in f.read().split()]
+        except OSError:
+            pass
+        return sum(rss_mb(pid) for pid in pids)
+
+
+class MemorySampler:
+    def __init__(self, server: Server, interval: float = 0.2):
+        self.server = server
+        self.interval = interval
+        self.peak = 0.0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            self.peak = max(self.peak, self.server.rss_mb())
+            await asyncio.sleep(self.interval)
+
+    def __enter__(self):
+        self.peak = self.server.rss_mb()
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+
+def seed(users: int, group_size: int):
+    """Create accounts and groups straight in the database; returns tokens and groups."""
+    from app.auth.hashing import pwd_context
+    from app.auth.jwt import create_access_token
+    from app.database import SessionLocal
+    from app.models import conversation, file  # noqa: F401 - mappers User relates to
+    from app.models.message import Group, GroupMember
+    from app.models.user import User
+
+    hashed = pwd_context.hash(PASSWORD)
+    db = SessionLocal()
+    try:
+        accounts = [User(username=f"bench{i}", email=f"bench{i}@bench.local", hashed_password=hashed)
+                    for i in range(users)]
+        db.add_all(accounts)
+        db.flush()
+        groups = {}
+        for start in range(0, users, group_size):
+            members = [account.id for account in accounts[start:start + group_size]]
+            group = Group(name=f"bench-group-{start // group_size}", created_by=members[0])
+            db.add(group)
+            db.flush()
+            db.add_all(GroupMember(group_id=group.id, user_id=member) for member in members)
+            groups[group.id] = members
+        db.commit()
+        tokens = {account.id: create_access_token({"sub": account.username}) for account in accounts}
+        return tokens, groups
+    finally:
+        db.close()
+
+
+async def ws_scenario(server, args, tokens, groups):
+    user_ids = list(tokens)
+    group_of = {member: group_id for group_id, members in groups.items() for member in members}
+    ack_samples, delivery_samples = [], []
+    state = {"errors": 0}
+    stop = asyncio.Event()
+    ws_url = server.url.replace("http", "ws", 1)
+
+    async def user(user_id):
+        pending = {}
+        try:
+            async with websockets.connect(f"{ws_url}/api/chat/ws/{user_id}?token={tokens[user_id]}",
+                                          max_queue=None) as ws:
+                async def reader():
+                    async for raw in ws:
+                        frame = json.loads(raw)
+                        kind = frame.get("type")
+                        if kind == "ack":
+                            sent = pending.pop(frame["client_id"], None)
+                            if sent is not None:
+                                ack_samples.append((time.perf_counter() - sent) * 1000)
+                        elif kind == "error":
+                            state["errors"] += 1
+                        elif kind is None and frame.get("content", "").startswith("bench "):
+                            sent = float(frame["content"].split()[1])
+                            delivery_samples.append((time.perf_counter() - sent) * 1000)
+
+                reading = asyncio.create_task(reader())
+                client_id = 0
+                await asyncio.sleep(random.random() / args.ws_rate)
+                while not stop.is_set():
+                    client_id += 1
+                    message = {"content": f"bench {time.perf_counter()}", "client_id": client_id}
+                    if random.random() < args.group_ratio:
+                        message["group_id"] = group_of[user_id]
+                    else:
+                        message["receiver_id"] = random.choice(user_ids)
+                    pending[client_id] = time.perf_counter()
+                    await ws.send(json.dumps(message))
+                    await asyncio.sleep(1 / args.ws_rate)
+                await asyncio.sleep(0.5)  # let the last acks and deliveries arrive
+                reading.cancel()
+        except (OSError, websockets.WebSocketException):
+            state["errors"] += 1
+        state["errors"] += len(pending)
+
+    tasks = [asyncio.create_task(user(user_id)) for user_id in user_ids[:args.ws_users]]
+    started = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    stop.set()
+    elapsed = time.perf_counter() - started
+    await asyncio.gather(*tasks)
+    return {
+        "ws_ack": summarize(ack_samples, elapsed, state["errors"]),
+        "ws_delivery": summarize(delivery_samples, elapsed),
+    }
+
+
+async def run_workers(concurrency, duration, operation):
+    """Call ``operation(client, worker)`` in a loop on ``concurrency`` workers."""
+    samples, state = [], {"errors": 0}
+    stop = asyncio.Event()
+
+    async def worker(n):
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                ok = await operation(n)
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                samples.append((time.perf_counter() - started) * 1000)
+            else:
+                state["errors"] += 1
+
+    tasks = [asyncio.create_task(worker(n)) for n in range(concurrency)]
+    started = time.perf_counter()
+    await asyncio.sleep(duration)
+    stop.set()
+    await asyncio.gather(*tasks)
+    return samples, time.perf_counter() - started, state["errors"]
+
+
+async def login_scenario(client, args, tokens, groups):
+    usernames = [f"bench{i}" for i in range(len(tokens))]
+
+    async def login(n):
+        response = await client.post("/api/auth/token", data={
+            "username": random.choice(usernames), "password": PASSWORD
+        })
+        return response.status_code == 200
+
+    samples, elapsed, errors = await run_workers(args.login_concurrency, args.duration, login)
+    return {"login": summarize(samples, elapsed, errors)}
+
+
+async def history_scenario(client, args, tokens, groups):
+    user_ids = list(tokens)
+    group_of = {member: group_id for group_id, members in groups.items() for member in members}
+
+    async def fetch(n):
+        user_id = random.choice(user_ids)
+        headers = {"Authorization": f"Bearer {tokens[user_id]}"}
+        choice = random.random()
+        if choice < 0.4:
+            peer = random.choice([peer for peer in user_ids if peer != user_id])
+            url = f"/api/chat/messages/{peer}?limit=50"
+        elif choice < 0.7:
+            url = f"/api/chat/groups/{group_of[user_id]}/messages?limit=50"
+        elif choice < 0.85:
+            url = "/api/chat/conversations"
+        else:
+            url = "/api/chat/sync?since_id=0&limit=200"
+        return (await client.get(url, headers=headers)).status_code == 200
+
+    samples, elapsed, errors = await run_workers(args.history_concurrency, args.duration, fetch)
+    return {"history": summarize(samples, elapsed, errors)}
+
+
+async def files_scenario(client, args, tokens, groups):
+    user_ids = list(tokens)
+    uploaded = []  # (file_id, uploader, recipient)
+    upload_samples, download_samples = [], []
+    payloads = [os.urandom(args.file_size) for _ in range(8)]
+    transferred = {"bytes": 0}
+
+    async def transfer(n):
+        if uploaded and random.random() < args.download_ratio:
+            file_id, uploader, recipient = random.choice(uploaded)
+            headers = {"Authorization": f"Bearer {tokens[random.choice((uploader, recipient))]}"}
+            started = time.perf_counter()
+            response = await client.get(f"/api/ftp/download/{file_id}", headers=headers)
+            if response.status_code != 200:
+                return False
+            download_samples.append((time.perf_counter() - started) * 1000)
+            transferred["bytes"] += len(response.content)
+            return True
+        uploader, recipient = random.sample(user_ids, 2)
+        started = time.perf_counter()
+        # Distinct content for half the uploads, repeats for the rest (dedup path)
+        payload = os.urandom(args.file_size) if random.random() < 0.5 else random.choice(payloads)
+        response = await client.post(
+            "/api/ftp/upload",
+            headers={"Authorization": f"Bearer {tokens[uploader]}"},
+            files={"file": (f"bench-{n}.bin", payload)},
+            data={"recipient_id": str(recipient)},
+        )
+        if response.status_code != 200:
+            return False
+        upload_samples.append((time.perf_counter() - started) * 1000)
+        transferred["bytes"] += len(payload)
+        uploaded.append((response.json()["id"], uploader, recipient))
+        return True
+
+    _, elapsed, errors = await run_workers(args.files_concurrency, args.duration, transfer)
+    upload = summarize(upload_samples, elapsed, errors)
+    download = summarize(download_samples, elapsed)
+    upload["mb_per_s"] = download["mb_per_s"] = round(transferred["bytes"] / elapsed / 1024 / 1024, 2)
+    return {"upload": upload, "download": download}
+
+
+async def run(args):
+    server = Server(args.port or free_port(), args.workers)
+    await server.start()
+    results = {"config": {key: value for key, value in vars(args).items()
+                          if key not in ("save_baseline", "compare")},
+               "database": os.environ["DATABASE_URL"].split(":", 1)[0],
+               "scenarios": {}}
+    try:
+        tokens, groups = seed(args.users, args.group_size)
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(base_url=server.url, limits=limits, timeout=60) as client:
+            runners = {
+                "ws": lambda: ws_scenario(server, args, tokens, groups),
+                "login": lambda: login_scenario(client, args, tokens, groups),
+                "history": lambda: history_scenario(client, args, tokens, groups),
+                "files": lambda: files_scenario(client, args, tokens, groups),
+            }
+            for name in args.scenarios:
+                with MemorySampler(server) as memory:
+                    scenario = await runners[name]()
+                for metrics in scenario.values():
+                    metrics["server_rss_mb"] = round(memory.peak, 1)
+                results["scenarios"].update(scenario)
+    finally:
+        server.stop()
+    # ru_maxrss is KiB on Linux
+    results["client_peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return results
+
+
+def report(results):
+    print(f"database={results['database']} users={results['config']['users']} "
+          f"duration={results['config']['duration']}s per scenario")
+    print(f"{'scenario':<12}{'count':>8}{'errors':>8}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'p99 ms':>10}{'rss MB':>9}")
+    for name, metrics in results["scenarios"].items():
+        print(f"{name:<12}{metrics['count']:>8}{metrics['errors']:>8}{metrics['throughput']:>10}"
+              f"{metrics['p50_ms']:>10}{metrics['p95_ms']:>10}{metrics['p99_ms']:>10}"
+              f"{metrics['server_rss_mb']:>9}")
+        if "mb_per_s" in metrics:
+            print(f"{'':<12}transfer {metrics['mb_per_s']} MB/s")
+    print(f"load generator peak RSS: {results['client_peak_rss_mb']} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per scenario")
+    parser.add_argument("--users", type=int, default=100, help="accounts to seed")
+    parser.add_argument("--group-size", type=int, default=10, help="members per seeded group")
+    parser.add_argument("--ws-users", type=int, default=50, help="concurrent WebSocket users")
+    parser.add_argument("--ws-rate", type=float, default=2.0, help="messages per second per WebSocket user")
+    parser.add_argument("--group-ratio", type=float, default=0.2, help="share of WebSocket messages sent to groups")
+    parser.add_argument("--login-concurrency", type=int, default=20)
+    parser.add_argument("--history-concurrency", type=int, default=20)
+    parser.add_argument("--files-concurrency", type=int, default=8)
+    parser.add_argument("--file-size", type=int, default=256 * 1024, help="upload size in bytes")
+    parser.add_argument("--download-ratio", type=float, default=0.7, help="share of file operations that download")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--port", type=int, default=0, help="server port (default: any free port)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the workload mix")
+    parser.add_argument("--save-baseline", metavar="FILE", help="write the results to FILE")
+    parser.add_argument("--compare", metavar="FILE", help="flag regressions against the baseline in FILE")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="allowed relative change before a metric counts as a regression")
+    args = parser.parse_args(argv)
+    if args.ws_users > args.users:
+        parser.error("--ws-users cannot exceed --users")
+    random.seed(args.seed)
+
+    results = asyncio.run(run(args))
+    report(results)
+    if args.save_baseline:
+        save_baseline(args.save_baseline, results)
+        print(f"baseline saved to {args.save_baseline}")
+    if args.compare:
+        regressions = compare(load_baseline(args.compare), results, args.tolerance)
+        if regressions:
+            print(f"REGRESSIONS against {args.compare} (tolerance {args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"no regressions against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""Login storm benchmark.
+
+Measures /api/auth/token throughput under a burst of concurrent logins and
+the latency of an unrelated authenticated route (/api/auth/users/me) while
+the storm is running, compared to the same route on an idle server.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_login --concurrency 50 --duration 10
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# Point the app at a throwaway database before it is imported
+_workdir = tempfile.mkdtemp(prefix="bench-login-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_workdir, 'bench.db')}")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+
+import httpx  # noqa: E402
+
+from app.main import app  # noqa: E402
+from app.database import SessionLocal  # noqa: E402
+from app.models.user import User  # noqa: E402
+from app.auth.hashing import pwd_context, password_hasher  # noqa: E402
+from app.migrations import migrate  # noqa: E402
+
+from .stats import percentile  # noqa: E402
+
+PASSWORD = "benchmark-password"
+
+
+def seed_users(count):
+    hashed = pwd_context.hash(PASSWORD)
+    db = SessionLocal()
+    try:
+        db.add_all(User(username=f"user{i}", email=f"user{i}@bench.local", hashed_password=hashed)
+                   for i in range(count))
+        db.commit()
+    finally:
+        db.close()
+
+
+async def login(client, username):
+    return await client.post("/api/auth/token", data={"username": username, "password": PASSWORD})
+
+
+async def probe(client, headers, stop, samples, interval):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await client.get("/api/auth/users/me", headers=headers)
+        samples.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(interval)
+
+
+async def storm(client, worker_id, users, stop, results):
+    i = worker_id
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = await login(client, f"user{i % users}")
+        elapsed = (time.perf_counter() - started) * 1000
+        if response.status_code == 200:
+            results["ok"].append(elapsed)
+        elif response.status_code == 503:
+            results["rejected"] += 1
+        else:
+            results["failed"] += 1
+        i += 1
+
+
+async def run(args):
+    # ASGITransport never runs the lifespan, so create the schema here
+    migrate()
+    seed_users(args.users)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        token = (await login(client, "user0")).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        idle_samples = []
+        stop = asyncio.Event()
+        task = asyncio.create_task(probe(client, headers, stop, idle_samples, args.probe_interval))
+        await asyncio.sleep(min(args.duration, 3))
+        stop.set()
+        await task
+
+        busy_samples = []
+        results = {"ok": [], "rejected": 0, "failed": 0}
+        stop = asyncio.Event()
+        tasks = [asyncio.create_task(probe(client, headers, stop, busy_samples, args.probe_interval))]
+        tasks += [asyncio.create_task(storm(client, n, args.users, stop, results))
+                  for n in range(args.concurrency)]
+        started = time.perf_counter()
+        await asyncio.sleep(args.duration)
+        stop.set()
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    print(f"hasher workers={password_hasher.workers} max_pending={password_hasher.max_pending}")
+    print(f"login storm: concurrency={args.concurrency} duration={elapsed:.1f}s")
+    print(f"  successful logins: {len(results['ok'])} ({len(results['ok']) / elapsed:.1f}/s)")
+    print(f"  rejected (503):    {results['rejected']}")
+    print(f"  failed:            {results['failed']}")
+    if results["ok"]:
+        print(f"  login latency ms:  p50={percentile(results['ok'], 50):.1f} "
+              f"p95={percentile(results['ok'], 95):.1f} p99={percentile(results['ok'], 99):.1f}")
+    for label, samples in (("idle", idle_samples), ("during storm", busy_samples)):
+        print(f"/users/me {label}: n={len(samples)} "
+              f"p50={percentile(samples, 50):.1f}ms p95={percentile(samples, 95):.1f}ms "
+              f"p99={percentile(samples, 99):.1f}ms mean={statistics.fmean(samples) if samples else 0:.1f}ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent login clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run the storm")
+    parser.add_argument("--users", type=int, default=100, help="accounts to seed")
+    parser.add_argument("--probe-interval", type=float, default=0.01, help="seconds between probe requests")
+    asyncio.run(run(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
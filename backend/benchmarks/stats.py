@@ -0,0 +1,59 @@
+"""Latency statistics and baseline comparison shared by the benchmarks."""
+import json
+import os
+import statistics
+from typing import Dict, List
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples: List[float], elapsed: float, errors: int = 0) -> Dict[str, float]:
+    """Latency samples in milliseconds -> the numbers we report and compare."""
+    return {
+        "count": len(samples),
+        "errors": errors,
+        "throughput": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(samples, 50), 2),
+        "p95_ms": round(percentile(samples, 95), 2),
+        "p99_ms": round(percentile(samples, 99), 2),
+        "mean_ms": round(statistics.fmean(samples), 2) if samples else 0.0,
+    }
+
+
+def save_baseline(path: str, results: dict):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_baseline(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> List[str]:
+    """Regressions of current against baseline, as readable lines.
+
+    Latency percentiles and server memory may grow, and throughput may
+    shrink, by ``tolerance`` (a fraction) before they count; new errors
+    always count.
+    """
+    regressions = []
+    for name, metrics in current.get("scenarios", {}).items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms", "server_rss_mb"):
+            if before.get(key) and metrics[key] > before[key] * (1 + tolerance):
+                regressions.append(f"{name}.{key}: {before[key]} -> {metrics[key]}")
+        if before.get("throughput") and metrics["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}.throughput: {before['throughput']} -> {metrics['throughput']}")
+        if metrics["errors"] > before.get("errors", 0):
+            regressions.append(f"{name}.errors: {before.get('errors', 0)} -> {metrics['errors']}")
+    return regressions
@@ -1,7 +1,7 @@
 import { useState, useEffect, useRef } from "react";
 import { useRouter } from "next/router";
 import authService, { User } from "../services/auth";
-import chatService, { Message } from "../services/chat";
+import chatService, { HISTORY_PAGE_SIZE, Message } from "../services/chat";
 import fileService from "../services/file";
 import axios from "axios";
 import { IoSend, IoLogOut, IoCloudUpload, IoDocument } from "react-icons/io5";
@@ -12,7 +12,7 @@ import "../app/globals.css"; // Ensure you have Tailwind CSS set up
 
 const API_URL = "http://localhost:8000/api/auth";
 
-const formatMessageTime = (timestamp: string) => {
+const formatMessageTime = (timestamp: number | string) => {
   const date = new Date(timestamp);
   return date.toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
 };
@@ -22,6 +22,12 @@ export default function Chat() {
   const [users, setUsers] = useState<User[]>([]);
   const [selectedUser, setSelectedUser] = useState<User | null>(null);
   const [messages, setMessages] = useState<Message[]>([]);
+  // Smallest history id loaded so far, and whether older pages exist
+  const [oldestMessageId, setOldestMessageId] = useState<number | null>(null);
+  const [hasOlderMessages, setHasOlderMessages] = useState(false);
+  const [loadingOlder, setLoadingOlder] = useState(false);
+  // Set while prepending older history, which shouldn't jump to the bottom
+  const keepScrollRef = useRef(false);
   const [newMessage, setNewMessage] = useState("");
   const [selectedFile, setSelectedFile] = useState<File | null>(null);
   const [onlineStatus, setOnlineStatus] = useState<Record<number, boolean>>({});
@@ -34,6 +40,51 @@ export default function Chat() {
 
   const wsRef = useRef<CustomWebSocket | null>(null);
 
+  // Process messages to ensure consistent format
+  const normalizeMessage = (message: Message): Message => {
+    // Try to parse content as JSON (for WebSocket messages)
+    let content = message.content;
+    let file_info = message.file_info;
+
+    try {
+      const parsed = JSON.parse(message.content);
+      if (typeof parsed === "object") {
+        content = parsed.content || message.content;
+        file_info = parsed.file_info || message.file_info;
+      }
+    } catch (e) {
+      // Not JSON, use as-is
+    }
+
+    return {
+      ...message,
+      content,
+      file_info: file_info
+        ? {
+            id: file_info.id,
+            filename: file_info.filename,
+            size: file_info.size,
+            uploaded_at: file_info.uploaded_at,
+          }
+        : undefined,
+    };
+  };
+
+  // History is paged newest first; each click prepends the previous page
+  const loadOlderMessages = async () => {
+    if (!selectedUser || oldestMessageId === null || loadingOlder) return;
+    setLoadingOlder(true);
+    try {
+      const older = await chatService.getMessages(selectedUser.id, oldestMessageId);
+      keepScrollRef.current = true;
+      setMessages((prev) => [...older.map(normalizeMessage), ...prev]);
+      if (older.length) setOldestMessageId(older[0].id);
+      setHasOlderMessages(older.length === HISTORY_PAGE_SIZE);
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
   useEffect(() => {
     const checkAuth = async () => {
       const user = await authService.getCurrentUser();
@@ -80,37 +131,9 @@ export default function Chat() {
       const loadMessages = async () => {
         const fetchedMessages = await chatService.getMessages(selectedUser.id);
 
-        // Process all messages to ensure consistent format
-        const processedMessages = fetchedMessages.map((message: Message) => {
-          // Try to parse content as JSON (for WebSocket messages)
-          let content = message.content;
-          let file_info = message.file_info;
-
-          try {
-            const parsed = JSON.parse(message.content);
-            if (typeof parsed === "object") {
-              content = parsed.content || message.content;
-              file_info = parsed.file_info || message.file_info;
-            }
-          } catch (e) {
-            // Not JSON, use as-is
-          }
-
-          return {
-            ...message,
-            content,
-            file_info: file_info
-              ? {
-                  id: file_info.id,
-                  filename: file_info.filename,
-                  size: file_info.size,
-                  uploaded_at: file_info.uploaded_at,
-                }
-              : undefined,
-          };
-        });
-
-        setMessages(processedMessages);
+        setMessages(fetchedMessages.map(normalizeMessage));
+        setOldestMessageId(fetchedMessages.length ? fetchedMessages[0].id : null);
+        setHasOlderMessages(fetchedMessages.length === HISTORY_PAGE_SIZE);
       };
 
       loadMessages();
@@ -185,6 +208,10 @@ export default function Chat() {
   };
   // Add this useEffect to handle auto-scrolling
   useEffect(() => {
+    if (keepScrollRef.current) {
+      keepScrollRef.current = false;
+      return;
+    }
     scrollToBottom();
   }, [messages, selectedUser]);
 
@@ -471,6 +498,17 @@ export default function Chat() {
               style={{ display: "flex", flexDirection: "column" }}
             >
               <div style={{ flex: 1, overflowY: "auto" }}>
+                {hasOlderMessages && (
+                  <div className="flex justify-center mb-4">
+                    <button
+                      onClick={loadOlderMessages}
+                      disabled={loadingOlder}
+                      className="text-sm text-indigo-600 hover:underline disabled:text-gray-400"
+                    >
+                      {loadingOlder ? "Loading..." : "Load older messages"}
+                    </button>
+                  </div>
+                )}
                 {messages.length === 0 ? (
                   <div className="h-full flex flex-col items-center justify-center text-gray-400">
                     <div className="w-16 h-16 rounded-full bg-gray-200 mb-4 flex items-center justify-center">
@@ -1,7 +1,7 @@
 import { useState, useEffect } from "react";
 import { useRouter } from "next/router";
 import authService from "../services/auth";
-import fileService, { FileInfo } from "../services/file";
+import fileService, { FileInfo, FILE_PAGE_SIZE } from "../services/file";
 import axios from "axios";
 import "../app/globals.css";
 interface User {
@@ -13,6 +13,8 @@ interface User {
 export default function Files() {
   const router = useRouter();
   const [files, setFiles] = useState<FileInfo[]>([]);
+  const [hasMoreFiles, setHasMoreFiles] = useState(false);
+  const [loadingMore, setLoadingMore] = useState(false);
   // const [fileToUpload, setFileToUpload] = useState<File | null>(null);
   // const [isUploading, setIsUploading] = useState(false);
   // const [isDragging, setIsDragging] = useState(false);
@@ -39,6 +41,7 @@ export default function Files() {
     try {
       const userFiles = await fileService.getUserFiles();
       setFiles(userFiles);
+      setHasMoreFiles(userFiles.length === FILE_PAGE_SIZE);
       // Calculate storage used (sum of all file sizes)
       const used = userFiles.reduce((sum: number, file: FileInfo) => sum + file.size, 0);
       setStorageUsed(used);
@@ -48,6 +51,23 @@ export default function Files() {
     }
   };
 
+  const loadMoreFiles = async () => {
+    if (loadingMore || files.length === 0) return;
+    setLoadingMore(true);
+    try {
+      // Pages are newest first, so the last file shown has the smallest id
+      const olderFiles = await fileService.getUserFiles(files[files.length - 1].id);
+      setFiles((prev) => [...prev, ...olderFiles]);
+      setHasMoreFiles(olderFiles.length === FILE_PAGE_SIZE);
+      setStorageUsed((prev) => prev + olderFiles.reduce((sum: number, file: FileInfo) => sum + file.size, 0));
+    } catch (err) {
+      console.error("Error loading more files:", err);
+      setError("Failed to load files");
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   // Format file size in human-readable format
   const formatFileSize = (bytes: number): string => {
     if (bytes === 0) return '0 Bytes';
@@ -362,6 +382,17 @@ export default function Files() {
               ))}
             </div>
           )}
+          {hasMoreFiles && (
+            <div className="flex justify-center mt-4">
+              <button
+                onClick={loadMoreFiles}
+                disabled={loadingMore}
+                className="text-sm text-teal-600 hover:underline disabled:text-gray-400"
+              >
+                {loadingMore ? "Loading..." : "Load more files"}
+              </button>
+            </div>
+          )}
         </div>
       </div>
     </div>
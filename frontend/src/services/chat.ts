@@ -14,16 +14,23 @@ export interface Message {
   content: string;
   sender_id: number;
   receiver_id: number;
-  created_at: string;
+  // Epoch milliseconds from the server; ISO strings for local echoes
+  created_at: number | string;
   file_info?: FileInfo;
 }
 
+export const HISTORY_PAGE_SIZE = 50;
+
 const chatService = {
-  async getMessages(userId: number): Promise<Message[]> {
+  // One page of history, oldest first; pass the smallest id already shown
+  // as beforeId to page further back
+  async getMessages(userId: number, beforeId?: number, limit: number = HISTORY_PAGE_SIZE): Promise<Message[]> {
     if (!userId) {
       throw new Error('User ID is required to fetch messages');
     }
-    const response = await axios.get(`${API_URL}/chat/messages/${userId}`);
+    const response = await axios.get(`${API_URL}/chat/messages/${userId}`, {
+      params: { limit, ...(beforeId !== undefined ? { before_id: beforeId } : {}) }
+    });
     console.log("Response Data: ",response.data);
     if (response.data.length === 0) {
       console.warn('No messages found for this user');
@@ -53,34 +60,59 @@ const chatService = {
   },
 
   setupWebSocket(userId: number, onMessage: (message: Message) => void, onPresenceChange?: (userId: number, isOnline: boolean) => void) {
-    const ws = new WebSocket(`ws://localhost:8000/api/chat/ws/${userId}`);
+    // v2 lets the server fold queued events into one batch frame;
+    // the browser negotiates permessage-deflate on its own. WebSockets
+    // can't carry the Authorization header, so the token goes in the URL.
+    const token = encodeURIComponent(localStorage.getItem('token') || '');
+    const ws = new WebSocket(`ws://localhost:8000/api/chat/ws/${userId}?token=${token}`, ["chat.v2.json"]);
     
     ws.onopen = () => {
       console.log('WebSocket connection established');
     };
     
+    // eslint-disable-next-line @typescript-eslint/no-explicit-any
+    const handleFrame = (data: any) => {
+      if (data.type === "batch") {
+        // Several events in one frame, in the order they were sent
+        (data.frames || []).forEach(handleFrame);
+      } else if (data.type === "presence" && onPresenceChange) {
+        // Handle presence updates
+        onPresenceChange(data.user_id, data.is_online);
+      } else if (data.type === "presence_snapshot" || data.type === "presence_diff") {
+        // Batched presence: snapshot on connect, then periodic diffs
+        if (onPresenceChange) {
+          (data.online || []).forEach((id: number) => onPresenceChange(id, true));
+          (data.offline || []).forEach((id: number) => onPresenceChange(id, false));
+        }
+      } else if (data.type === "sync") {
+        // Messages missed while disconnected, oldest first
+        (data.messages || []).forEach((message: Message) => onMessage(message));
+        if (data.has_more) {
+          ws.send(JSON.stringify({ type: "resume", last_id: data.last_id }));
+        }
+      } else if (data.type) {
+        // Other control frames (acks etc.) are not chat messages
+        return;
+      } else {
+        // Handle regular messages
+        const message = {
+          ...data,
+          created_at: data.created_at || new Date().toISOString(),
+          // Ensure file_info is properly structured if present
+          file_info: data.file_info ? {
+            id: data.file_info.id,
+            filename: data.file_info.filename,
+            size: data.file_info.size,
+            uploaded_at: data.file_info.uploaded_at
+          } : undefined
+        };
+        onMessage(message);
+      }
+    };
+
     ws.onmessage = (event) => {
       try {
-        const data = JSON.parse(event.data);
-        
-        if (data.type === "presence" && onPresenceChange) {
-          // Handle presence updates
-          onPresenceChange(data.user_id, data.is_online);
-        } else {
-          // Handle regular messages
-          const message = {
-            ...data,
-            created_at: data.created_at || new Date().toISOString(),
-            // Ensure file_info is properly structured if present
-            file_info: data.file_info ? {
-              id: data.file_info.id,
-              filename: data.file_info.filename,
-              size: data.file_info.size,
-              uploaded_at: data.file_info.uploaded_at
-            } : undefined
-          };
-          onMessage(message);
-        }
+        handleFrame(JSON.parse(event.data));
       } catch (error) {
         console.error('Error parsing WebSocket message:', error);
       }
@@ -101,6 +133,12 @@ const chatService = {
           }));
         }
       },
+      // Ask for everything newer than the last message id the client has seen
+      resume: (lastId: number) => {
+        if (ws.readyState === WebSocket.OPEN) {
+          ws.send(JSON.stringify({ type: "resume", last_id: lastId }));
+        }
+      },
       close: () => ws.close()
     };
   }
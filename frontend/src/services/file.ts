@@ -8,6 +8,8 @@ export interface FileInfo {
   size: number;
   uploaded_at: string;
 }
+export const FILE_PAGE_SIZE = 50;
+
 let currentSelectedUserId: number | null = null;
 const fileService = {
 
@@ -28,11 +30,14 @@ const fileService = {
     });
     return response.data;
   },
-  async getUserFiles(): Promise<FileInfo[]> {
+  // One page of files, newest first; pass the smallest id already shown
+  // as beforeId to fetch the next page
+  async getUserFiles(beforeId?: number, limit: number = FILE_PAGE_SIZE): Promise<FileInfo[]> {
     try {
       const token = localStorage.getItem('token');
       const response = await axios.get(`${API_URL}/ftp/files/${currentSelectedUserId}`, {
-        headers: { Authorization: `Bearer ${token}` }
+        headers: { Authorization: `Bearer ${token}` },
+        params: { limit, ...(beforeId !== undefined ? { before_id: beforeId } : {}) }
       });
       return response.data.map((file: { id: number; filename: string; size: number; uploaded_at: string; sender_id: number; receiver_id: number }) => ({
         id: file.id,